@@ -2,82 +2,193 @@
 """
 One-off script to backfill jira_key for existing DB records.
 
-For each row with no jira_key, searches Jira by file_name (customfield_11689)
-and reports what was found or is missing.
+For each row with no jira_key, searches Jira by file_name (customfield_11689),
+many file names per query, and matches the issues found to rows by summary.
+Rows left unmatched fall back to a search by display_name, unless --no-fallback
+is given. Reports what was found or is missing.
+
+With --mirror, the local jira_issue mirror is synced first (fully the first
+time, then only issues updated since) and rows are resolved against it; only
+rows it can't resolve are searched in Jira.
+
+With --processes N, the rows are split into booklet_number ranges that N
+worker processes claim one at a time through leases in the backfill_lease
+table, so no two workers search the same rows and a crashed worker's range is
+taken over once its lease expires. The DB is in WAL mode, so the workers'
+writes can run alongside a main.py ingest.
 
 Runs in dry-run mode by default; pass --fix to actually write keys to the DB.
 """
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import logging
-import time
+import multiprocessing
+import os
+import socket
 
 import database
-from jira import JiraApi
+import metrics
+from jira import DEFAULT_RATE, DEFAULT_WORKERS, JiraApi
 
 
 logger = logging.getLogger(__name__)
 
+CHUNK_SIZE = 500  # rows searched between DB writes, so an interrupted run keeps its progress
+SHARDS_PER_PROCESS = 4  # more shards than processes, so one slow range doesn't hold up the end
+LEASE_SECONDS = 10 * 60  # renewed after every chunk; a worker silent for longer loses its shard
 
-def main():
-    parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument(
-        '--fix', action='store_true',
-        help='Write found Jira keys to the DB (default: report only)'
-    )
-    parser.add_argument(
-        '--from-booklet', type=int, metavar='BOOKLET_NUMBER',
-        help='Only process records with booklet_number >= this value'
-    )
-    parser.add_argument(
-        '--limit', type=int,
-        help='Process at most this many booklets (useful for testing)'
-    )
-    parser.add_argument('--log', default='info')
-    args = parser.parse_args()
 
+def limit_booklets(items, limit):
+    """Keep the rows of the first `limit` booklet numbers of `items`."""
+    seen_nums = set()
+    limited = []
+    for item in items:
+        seen_nums.add(item['booklet_number'])
+        if len(seen_nums) > limit:
+            break
+        limited.append(item)
+    return limited
+
+
+def plan_shards(items, shards):
+    """Split the booklet numbers of `items` into at most `shards` inclusive (first, last)
+    ranges holding about as many rows each. A booklet's rows always stay in one range."""
+    counts = {}
+    for item in items:
+        counts[item['booklet_number']] = counts.get(item['booklet_number'], 0) + 1
+    target = -(-len(items) // shards)
+    ranges = []
+    first = None
+    size = 0
+    for booklet_number in sorted(counts):
+        if first is None:
+            first = booklet_number
+        size += counts[booklet_number]
+        if size >= target:
+            ranges.append((first, booklet_number))
+            first = None
+            size = 0
+    if first is not None:
+        ranges.append((first, max(counts)))
+    return ranges
+
+
+def resolve_chunk(db, jira, chunk, args):
+    """Search Jira for the rows of `chunk` and, with --fix, write the keys found.
+    Returns the number of rows found and the booklet numbers of those not found."""
+    run_metrics = metrics.current()
+    found = []
+    missing = []
+    with run_metrics.stage('search'):
+        results = jira.find_keys(chunk)
+        unmatched = [item for item, jira_key in results if not jira_key]
+        if unmatched and not args.no_fallback:
+            logger.debug(f'{len(unmatched)} row(s) unmatched by file name, searching by display_name')
+            fallback = dict((item['id'], jira_key) for item, jira_key in jira.search_many(unmatched))
+            results = [(item, jira_key or fallback.get(item['id'])) for item, jira_key in results]
+    for item, jira_key in results:
+        booklet_num = item['booklet_number']
+        display_name = item['display_name']
+        if jira_key:
+            logger.info(f'  #{booklet_num} ({display_name}): found {jira_key}')
+            found.append((item['id'], jira_key))
+        else:
+            logger.info(f'  #{booklet_num} ({display_name}): not found in Jira')
+            missing.append(booklet_num)
+    if args.fix:
+        with run_metrics.stage('write'):
+            db.update_jira_keys_by_id(found)
+    return len(found), missing
+
+
+def shard_worker(args, rate):
+    """Run in a worker process: claim shards and resolve their rows until none is left.
+    Returns the number of rows found, the booklet numbers not found and the metrics."""
     logging.basicConfig(level=getattr(logging, args.log.upper()))
+    owner = f'{socket.gethostname()}:{os.getpid()}'
+    found = 0
+    missing = []
+    profile = os.path.join(args.profile, f'worker-{os.getpid()}') if args.profile else None
+    with metrics.collect('backfill_jira_keys', profile=profile) as run, database.Database() as db:
+        jira = JiraApi(workers=args.workers, rate=rate, mirror=db if args.mirror else None)
+        while (shard := db.claim_backfill_shard(owner, LEASE_SECONDS)) is not None:
+            # Loaded now rather than at planning time, so rows resolved since are skipped
+            items = db.get_all_without_jira_key(shard['from_booklet'], shard['to_booklet'])
+            logger.info(f'{owner}: shard {shard["shard"]}, booklets #{shard["from_booklet"]}-'
+                        f'#{shard["to_booklet"]}, {len(items)} row(s)')
+            for start in range(0, len(items), CHUNK_SIZE):
+                chunk_found, chunk_missing = resolve_chunk(db, jira, items[start:start + CHUNK_SIZE], args)
+                found += chunk_found
+                missing.extend(chunk_missing)
+                if not db.renew_backfill_lease(shard['shard'], owner, LEASE_SECONDS):
+                    logger.warning(f'{owner}: lost the lease on shard {shard["shard"]} to another worker')
+                    break
+            else:
+                db.finish_backfill_shard(shard['shard'], owner)
+    return found, missing, run.as_dict()
+
 
-    jira = JiraApi()
+def backfill_sharded(db, items, args):
+    """Resolve `items` in `args.processes` worker processes, each claiming booklet_number
+    ranges through the backfill_lease table. Returns like resolve_chunk."""
+    ranges = plan_shards(items, args.processes * SHARDS_PER_PROCESS)
+    if not db.plan_backfill_shards(ranges):
+        raise SystemExit('Another sharded backfill is still running; wait for it to finish '
+                         f'or for its leases to expire ({LEASE_SECONDS}s)')
+    logger.info(f'{len(ranges)} shard(s) over {args.processes} worker process(es)')
+    found = 0
+    missing = []
+    # Spawned rather than forked: an SQLite connection must not cross a fork
+    with ProcessPoolExecutor(args.processes, mp_context=multiprocessing.get_context('spawn')) as executor:
+        # --rate caps the requests of all processes together
+        futures = [executor.submit(shard_worker, args, args.rate / args.processes)
+                   for _ in range(args.processes)]
+        for future in futures:
+            worker_found, worker_missing, worker_metrics = future.result()
+            found += worker_found
+            missing.extend(worker_missing)
+            metrics.current().merge(worker_metrics)
+    return found, missing
+
+
+def backfill(args):
+    run_metrics = metrics.current()
 
     with database.Database() as db:
-        items = db.get_all_without_jira_key(from_booklet=args.from_booklet)
+        jira = JiraApi(workers=args.workers, rate=args.rate, mirror=db if args.mirror else None)
+        if args.mirror:
+            with run_metrics.stage('sync_mirror'):
+                synced = jira.sync_mirror(db, full=args.full_sync)
+            if synced is None:
+                logger.warning('Jira mirror sync failed, resolving against the mirror as it is')
+
+        with run_metrics.stage('load'):
+            items = db.get_all_without_jira_key(from_booklet=args.from_booklet)
         logger.info(
             f'{len(items)} DB record(s) have no jira_key'
             + (f' (from booklet #{args.from_booklet})' if args.from_booklet else '')
         )
         if args.limit:
-            seen_nums = set()
-            limited = []
-            for item in items:
-                seen_nums.add(item['booklet_number'])
-                limited.append(item)
-                if len(seen_nums) >= args.limit:
-                    break
-            items = limited
+            items = limit_booklets(items, args.limit)
             logger.info(f'limiting to {args.limit} booklet(s) ({len(items)} row(s))')
 
-        found = []
-        missing = []
-
-        for item in items:
-            booklet_num = item['booklet_number']
-            display_name = item['display_name']
-            jira_key = jira.search_by_display_name(display_name, published_date=item.get('published_date'))
-            if jira_key:
-                logger.info(f'  #{booklet_num} ({display_name}): found {jira_key}')
-                found.append((item, jira_key))
-                if args.fix:
-                    db.update_jira_key_by_id(item['id'], jira_key)
-            else:
-                logger.info(f'  #{booklet_num} ({display_name}): not found in Jira')
-                missing.append(booklet_num)
-
-            time.sleep(0.2)  # avoid hammering the Jira API
+        if args.processes > 1 and items:
+            found, missing = backfill_sharded(db, items, args)
+        else:
+            found = 0
+            missing = []
+            for start in range(0, len(items), CHUNK_SIZE):
+                chunk_found, chunk_missing = resolve_chunk(db, jira, items[start:start + CHUNK_SIZE], args)
+                found += chunk_found
+                missing.extend(chunk_missing)
 
+        run_metrics.incr('rows_pending', len(items))
+        run_metrics.incr('rows_found', found)
+        run_metrics.incr('rows_missing', len(missing))
         missing_unique = sorted(set(missing))
         logger.info(
-            f'\nSummary: {len(found)} row(s) found in Jira, '
+            f'\nSummary: {found} row(s) found in Jira, '
             f'{len(set(missing))} booklet(s) not found ({len(missing)} row(s))'
         )
         if missing_unique:
@@ -86,5 +197,66 @@ def main():
             logger.info('Re-run with --fix to write the keys to the DB')
 
 
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--fix', action='store_true',
+        help='Write found Jira keys to the DB (default: report only)'
+    )
+    parser.add_argument(
+        '--from-booklet', type=int, metavar='BOOKLET_NUMBER',
+        help='Only process records with booklet_number >= this value'
+    )
+    parser.add_argument(
+        '--limit', type=int,
+        help='Process at most this many booklets (useful for testing)'
+    )
+    parser.add_argument(
+        '--mirror', action='store_true',
+        help='Sync the local Jira issue mirror and resolve rows against it before searching Jira'
+    )
+    parser.add_argument(
+        '--full-sync', action='store_true',
+        help='With --mirror, re-pull every issue instead of only those updated since the last sync'
+    )
+    parser.add_argument(
+        '--no-fallback', action='store_true',
+        help='Do not search by display_name for rows whose file name search found no match'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=DEFAULT_WORKERS,
+        help=f'Number of concurrent Jira searches (default: {DEFAULT_WORKERS})'
+    )
+    parser.add_argument(
+        '--processes', type=int, default=1,
+        help=(
+            'Split the rows by booklet number range across this many worker processes, '
+            'which claim the ranges through leases in the DB (default: 1, no sharding)'
+        )
+    )
+    parser.add_argument(
+        '--rate', type=float, default=DEFAULT_RATE,
+        help=f'Maximum Jira requests per second across all workers (default: {DEFAULT_RATE})'
+    )
+    parser.add_argument(
+        '--metrics-textfile', metavar='PATH',
+        help='Also write the run metrics to this file in the Prometheus textfile format'
+    )
+    parser.add_argument(
+        '--profile', metavar='DIR',
+        help=(
+            'Profile every stage with cProfile and tracemalloc and write the results to DIR '
+            '(with --processes, each worker to a subdirectory of its own)'
+        )
+    )
+    parser.add_argument('--log', default='info')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log.upper()))
+
+    with metrics.record_run('backfill_jira_keys', textfile=args.metrics_textfile, profile=args.profile):
+        backfill(args)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Offline end-to-end benchmark of the ingest pipeline.
+
+Serves Search API responses of configurable sizes from a local stand-in for the
+Reshumot endpoint, and runs main.ingest() against it and against a local
+stand-in Jira with configurable latency and 429 behavior, in a scratch DB, as
+main.py --update-jira would: the probe, the concurrent fetch, clean_data, the
+selection in SQL, the insert and the outbox drain. Then the newest --changed
+records of each type are corrected and it runs again, which updates their rows
+and issues. The per-stage metrics of both runs are written to a JSON report
+that can be compared against a previous one with --baseline.
+
+Records are synthesized, or built from a recorded Search API response given with
+--fixture (its records are cycled with fresh booklet numbers).
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import database
+import jira
+import main as pipeline
+import metrics
+import scraper
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = '500,5000,20000,100000'
+DEFAULT_OUTPUT = 'bench_report.json'
+DEFAULT_CHANGED = 100
+PASSES = ['ingest', 'rerun']  # into an empty DB, then after correcting the newest records
+
+
+def synthetic_record(folder_type, booklet_number):
+    laws = '<br/>'.join(f'חוק לדוגמה (תיקון מס\' {n}), התשפ"ב-2021\t{1000 + n}' for n in range(3))
+    return {
+        'Data': {
+            'CreationDate': '2021-12-09T15:05:53+02:00',
+            'ModifyDate': '2021-12-09T16:07:10+02:00',
+            'PublishDate': '2021-12-09T15:05:50+02:00',
+            'Pages': 4,
+            'BookletNum': booklet_number,
+            'ForeignYear': 2021,
+            'Document': [{
+                'DisplayName': f'קובץ-{folder_type}-{booklet_number}',
+                'FileName': f'https://example.invalid/Documents/{folder_type}-{booklet_number}.pdf',
+                'Extension': 'pdf',
+            }],
+            'DocSummary': {'DescriptionHtmlString': laws},
+        }
+    }
+
+
+def correct_records(records, count):
+    """Change the page count of the newest `count` serialized records, as a correction would."""
+    for index in range(min(count, len(records))):
+        record = json.loads(records[index])
+        record['Data']['Pages'] += 1
+        records[index] = json.dumps(record, ensure_ascii=False).encode('utf8')
+
+
+def build_records(size, folder_type, templates=None):
+    """`size` records newest-first, as the Search API returns them, serialized once up front."""
+    records = []
+    for index in range(size):
+        booklet_number = size - index
+        if templates:
+            record = copy.deepcopy(templates[index % len(templates)])
+            record['Data']['BookletNum'] = booklet_number
+            for document in record['Data']['Document']:
+                document['FileName'] = f'{document["FileName"]}#{folder_type}-{booklet_number}'
+        else:
+            record = synthetic_record(folder_type, booklet_number)
+        records.append(json.dumps(record, ensure_ascii=False).encode('utf8'))
+    return records
+
+
+class ReshumotHandler(BaseHTTPRequestHandler):
+    records = {}  # FolderType -> list of serialized records
+
+    def do_POST(self):
+        query = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        skip, limit = int(query['skip']), int(query['limit'])
+        page = self.records.get(query['FolderType'], [])[skip:skip + limit]
+        body = b'{"Results": [' + b','.join(page) + b']}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class JiraHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    throttle_every = 0  # answer every Nth request with a 429
+    retry_after = 1
+    requests = 0
+    throttled = 0
+    lock = threading.Lock()
+
+    def _reply(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])) or b'{}')
+        with JiraHandler.lock:
+            JiraHandler.requests += 1
+            number = JiraHandler.requests
+            throttle = self.throttle_every and number % self.throttle_every == 0
+            if throttle:
+                JiraHandler.throttled += 1
+        time.sleep(self.latency)
+        if throttle:
+            return self._reply(429, {}, {'Retry-After': str(self.retry_after)})
+        if self.path.endswith('/issue/bulk'):
+            issues = [{'key': f'KOL-{number}-{i}'} for i, _ in enumerate(body['issueUpdates'])]
+            return self._reply(201, {'issues': issues, 'errors': []})
+        return self._reply(200, {'issues': [], 'isLast': True})
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        with JiraHandler.lock:
+            JiraHandler.requests += 1
+        time.sleep(self.latency)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def run_ingest(db, args, jira_url):
+    """Run main.ingest() once, recorded like a main.py run; return its metrics and wall time."""
+    def make_jira_api():
+        return jira.JiraApi(workers=args.jira_workers, rate=args.jira_rate, base_url=jira_url)
+
+    with metrics.record_run('benchmark', db=db) as run:
+        start = time.perf_counter()
+        pipeline.ingest(db, args.pipeline, make_jira_api=make_jira_api)
+        seconds = time.perf_counter() - start
+    return dict(run.as_dict(), total_seconds=round(seconds, 4))
+
+
+def run_size(size, args, templates, jira_url):
+    """Ingest `size` records per folder type into a scratch DB, then again after correcting the
+    newest of them; return the metrics of both runs."""
+    ReshumotHandler.records = {
+        folder_type: build_records(size, folder_type, templates) for folder_type in scraper.FOLDER_TYPES.values()
+    }
+    args.pipeline.fetch_limit = size
+    runs = {}
+    with tempfile.TemporaryDirectory() as scratch, \
+            database.Database(os.path.join(scratch, 'bench.sqlite')) as db:
+        runs['ingest'] = run_ingest(db, args, jira_url)
+        for records in ReshumotHandler.records.values():
+            correct_records(records, args.changed)
+        runs['rerun'] = run_ingest(db, args, jira_url)
+    return {'records_per_type': size, **runs}
+
+
+def compare(report, baseline):
+    """Log the change of every stage of both runs against a baseline report, matched by size."""
+    previous = {run['records_per_type']: run for run in baseline.get('runs', [])}
+    for run in report['runs']:
+        before = previous.get(run['records_per_type'])
+        if not before:
+            continue
+        lines = []
+        for name in PASSES:
+            if name not in before:
+                continue
+            stages = dict(run[name]['stages'], total=run[name]['total_seconds'])
+            before_stages = dict(before[name]['stages'], total=before[name]['total_seconds'])
+            for stage, now in stages.items():
+                then = before_stages.get(stage)
+                if then:
+                    lines.append(f'  {name:<6} {stage:<11} {then:>9.3f}s -> {now:>9.3f}s '
+                                 f'({(now - then) / then:+.1%})')
+        logger.info(f'{run["records_per_type"]} records per type vs. baseline:\n' + '\n'.join(lines))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--sizes', default=DEFAULT_SIZES,
+        help=f'Comma-separated numbers of records per folder type to benchmark (default: {DEFAULT_SIZES})'
+    )
+    parser.add_argument('--fixture', help='A recorded Search API response whose records are replayed')
+    parser.add_argument('--page-size', type=int, default=scraper.DEFAULT_PAGE_SIZE)
+    parser.add_argument('--lookback', type=int, default=pipeline.DEFAULT_LOOKBACK)
+    parser.add_argument('--workers', type=int, default=scraper.DEFAULT_POOL_SIZE)
+    parser.add_argument(
+        '--changed', type=int, default=DEFAULT_CHANGED,
+        help=f'Newest records of each type to correct before the second run (default: {DEFAULT_CHANGED})'
+    )
+    parser.add_argument('--jira-latency', type=float, default=0.05, help='Seconds per Jira request')
+    parser.add_argument('--jira-429-every', type=int, default=0, help='Answer every Nth Jira request with a 429')
+    parser.add_argument('--jira-retry-after', type=int, default=1, help='Retry-After of those 429s')
+    parser.add_argument('--jira-workers', type=int, default=jira.DEFAULT_WORKERS)
+    parser.add_argument('--jira-rate', type=float, default=100.0)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help=f'Report path (default: {DEFAULT_OUTPUT})')
+    parser.add_argument('--baseline', help='A previous report to compare against')
+    parser.add_argument('--log', default='info')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log.upper()))
+    # The pipeline logs every item at info level, which would dominate the timings
+    for name in ('main', 'jira', 'outbox', 'metrics', 'scraper', 'cleaner', 'database'):
+        logging.getLogger(name).setLevel(max(logging.WARNING, logging.getLogger().level))
+
+    templates = None
+    if args.fixture:
+        with open(args.fixture, encoding='utf8') as f:
+            templates = json.load(f)['Results']
+
+    JiraHandler.latency = args.jira_latency
+    JiraHandler.throttle_every = args.jira_429_every
+    JiraHandler.retry_after = args.jira_retry_after
+    reshumot_server, scraper.SEARCH_URL = serve(ReshumotHandler)
+    jira_server, jira_url = serve(JiraHandler)
+    os.environ.setdefault('JIRA_API_USER', 'benchmark@example.invalid')
+    os.environ.setdefault('JIRA_API_TOKEN', 'benchmark')
+    # The settings main.py would run with, so the benchmark follows its defaults
+    args.pipeline = pipeline.build_parser().parse_args([
+        '--page-size', str(args.page_size), '--lookback', str(args.lookback), '--workers', str(args.workers),
+        '--no-cache', '--update-jira',
+    ])
+
+    report = {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'settings': {key: value for key, value in vars(args).items()
+                     if key not in ('output', 'baseline', 'log', 'pipeline')},
+        'runs': [],
+    }
+    try:
+        for size in (int(size) for size in args.sizes.split(',')):
+            JiraHandler.requests = JiraHandler.throttled = 0
+            run = run_size(size, args, templates, jira_url)
+            run['jira'] = {'requests': JiraHandler.requests, 'throttled': JiraHandler.throttled}
+            report['runs'].append(run)
+            for name in PASSES:
+                logger.info(f'{size} records per type, {name}: ' + ', '.join(
+                    f'{stage} {seconds:.3f}s' for stage, seconds in run[name]['stages'].items()
+                ) + f' (total {run[name]["total_seconds"]:.3f}s)')
+    finally:
+        reshumot_server.shutdown()
+        jira_server.shutdown()
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f'report written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
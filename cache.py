@@ -0,0 +1,107 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = '.cache/reshumot'
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60  # seconds
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+
+class ResponseCache:
+    """On-disk store of raw Search API pages, keyed by (FolderType, skip, limit).
+
+    Besides the body of each page, the cache keeps a fingerprint (SHA-256 of the
+    page's results) per key as of the last *committed* run. A page whose
+    fingerprint is unchanged was already fully processed, so the caller can skip
+    cleaning and filtering it. Fingerprints fetched during a run only become the
+    reference once commit() is called, so a run that crashes or is a dry run
+    does not hide its pages from the next one."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_age=DEFAULT_MAX_AGE, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self._fingerprints_path = os.path.join(directory, 'fingerprints.json')
+        self._pending = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self._fingerprints_path) as f:
+                self._committed = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._committed = {}
+
+    @staticmethod
+    def _key(folder_type, skip, limit):
+        return f'{folder_type}-{skip}-{limit}'
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    @staticmethod
+    def fingerprint(page):
+        """Hash of the page's records, independent of key order and whitespace in the body."""
+        canonical = json.dumps(page.get('Results') or [], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(canonical.encode('utf8')).hexdigest()
+
+    def get(self, folder_type, skip, limit):
+        """Return the cached page for this key regardless of age, or None if there is none."""
+        try:
+            with open(self._path(self._key(folder_type, skip, limit)), 'rb') as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def put(self, folder_type, skip, limit, body):
+        """Store a raw response body and return True if its page differs from the last committed run."""
+        key = self._key(folder_type, skip, limit)
+        path = self._path(key)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        digest = self.fingerprint(json.loads(body))
+        with self._lock:
+            self._pending[key] = digest
+            return self._committed.get(key) != digest
+
+    def commit(self):
+        """Make the fingerprints seen during this run the reference for the next one."""
+        with self._lock:
+            if not self._pending:
+                return
+            self._committed.update(self._pending)
+            self._pending = {}
+            tmp_path = f'{self._fingerprints_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self._committed, f)
+            os.replace(tmp_path, self._fingerprints_path)
+
+    def evict(self):
+        """Delete pages older than max_age, then the oldest pages until the cache fits in max_bytes."""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json') or name == 'fingerprints.json':
+                continue
+            path = os.path.join(self.directory, name)
+            stat = os.stat(path)
+            if now - stat.st_mtime > self.max_age:
+                os.remove(path)
+                logger.debug(f'cache: evicted {name} (expired)')
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            logger.debug(f'cache: evicted {os.path.basename(path)} (size limit)')
@@ -1,7 +1,22 @@
+import hashlib
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
+# The fields of a cleaned item that can be corrected after publication; booklet_number and
+# display_name identify the entry, so they're not part of its content
+CONTENT_FIELDS = ['creation_date', 'modify_date', 'number_of_pages', 'published_date',
+                  'file_name', 'extension', 'description', 'foreign_year']
+
+# Hebrew points and cantillation marks, except maqaf (U+05BE) and the punctuation among them
+NIQQUD = re.compile('[\u0591-\u05bd\u05bf\u05c1\u05c2\u05c4\u05c5\u05c7]')
+# Geresh and gershayim, in Hebrew or typed as ASCII quotes: התשפ"א, מס' 12
+GERSHAYIM = re.compile('[\u05f3\u05f4"\'`\u2018\u2019\u201c\u201d]')
+# A tab and the page number after it, as in display names: "...התשפ"ב-2021\t364"
+PAGE_NUMBER = re.compile(r'\t\s*\d*')
+NON_WORD = re.compile(r'[^\w]+')
+
 
 def clean(data):
     data = data.replace('<br/>', ' ').strip()
@@ -10,9 +25,16 @@ def clean(data):
 
 
 def clean_data(results, booklet_type):
+    """Clean a whole Search API response, oldest record first."""
+    return clean_records(reversed(results['Results']), booklet_type)
+
+
+def clean_records(records, booklet_type):
+    """Clean Search API records one at a time, in the order given, so `records` can be a
+    generator fed straight from the response stream."""
     split_texts = ["תיקונים עקיפים:", "תיקון עקיף:"]  # Define the texts to split the description
 
-    for result_dict in reversed(results['Results']):
+    for result_dict in records:
         data = result_dict['Data']
         if len(data['Document']) > 1:
             logger.error(f'data has more than 1 document {data["Document"][0]["DisplayName"]}')
@@ -46,4 +68,45 @@ def clean_data(results, booklet_type):
                 'foreign_year': data['ForeignYear'],
                 'booklet_type': booklet_type
             }
+            datum['content_hash'] = content_hash(datum)
             yield datum
+
+
+def content_hash(item):
+    """A digest of the content fields of a cleaned item, to tell whether a stored entry changed."""
+    content = '\x1f'.join('' if item[field] is None else str(item[field]) for field in CONTENT_FIELDS)
+    return hashlib.sha256(content.encode('utf8')).hexdigest()
+
+
+def dedup(items):
+    """Deduplicate within a batch: the API can return the same entry twice.
+    Key by (booklet_number, display_name) so different laws within the same
+    booklet are kept as separate entries."""
+    seen = {}
+    for item in items:
+        seen[(item['booklet_number'], item['display_name'])] = item
+    return list(seen.values())
+
+
+def iter_unique(items):
+    """Streaming counterpart of dedup(): yield each (booklet_number, display_name) once,
+    remembering only the keys seen so far."""
+    seen = set()
+    for item in items:
+        key = (item['booklet_number'], item['display_name'])
+        if key not in seen:
+            seen.add(key)
+            yield item
+
+
+def normalize_hebrew(text):
+    """Normalize text for full-text search: drop <br/>, page numbers after tabs, niqqud and
+    geresh/gershayim (so התשפ"א and התשפ״א both become התשפא), turn maqaf and other
+    punctuation into spaces and collapse whitespace."""
+    if not text:
+        return ''
+    text = text.replace('<br/>', ' ')
+    text = PAGE_NUMBER.sub(' ', text)
+    text = NIQQUD.sub('', text)
+    text = GERSHAYIM.sub('', text)
+    return NON_WORD.sub(' ', text).strip()
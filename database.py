@@ -1,4 +1,21 @@
+from contextlib import contextmanager
+import logging
 import sqlite3
+import threading
+import time
+
+from cleaner import content_hash, normalize_hebrew
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_PATH = 'kzdb.sqlite'
+
+# The columns every entry of one API record shares, stored once in the record_content table
+RECORD_CONTENT_COLUMNS = ['file_name', 'extension', 'number_of_pages', 'description', 'booklet_creation_date',
+                          'modify_date', 'published_date', 'foreign_year']
 
 
 class Database:
@@ -8,31 +25,593 @@ class Database:
         "notification": 3
     }
 
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        # Fetch workers share the connection; transactions must not interleave
+        self._lock = threading.RLock()
+
     def __enter__(self):
-        self.conn = sqlite3.connect('kzdb.sqlite')
+        # Fetch workers classify their pages from their own threads; the sqlite library
+        # serializes access to the connection itself, and _lock keeps transactions apart.
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
-        self._ensure_jira_key_column()
+        self._configure()
+        self._migrate()
         return self
 
+    def _configure(self):
+        """Tune the connection for ingest: with WAL, a commit appends to the log instead of
+        rewriting pages, and synchronous=NORMAL only fsyncs at checkpoints, which is still
+        safe against corruption. Readers no longer block the writer either."""
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute('PRAGMA cache_size = -16000')  # KiB
+        self.conn.execute('PRAGMA temp_store = MEMORY')
+        self.conn.execute('PRAGMA busy_timeout = 5000')  # ms
+
+    @contextmanager
+    def _transaction(self):
+        """Like `with self.conn:`, but times the commit for the run metrics."""
+        with self._lock:
+            try:
+                yield
+            except BaseException:
+                self.conn.rollback()
+                raise
+            start = time.perf_counter()
+            self.conn.commit()
+            metrics.current().incr('db_commit_seconds', time.perf_counter() - start)
+
+    def _migrate(self):
+        """Bring the schema up to date. PRAGMA user_version records the last migration applied;
+        each migration runs in its own transaction together with the version bump."""
+        migrations = [
+            self._ensure_jira_key_column,
+            self._add_indexes_and_unique_key,
+            self._add_jira_issue_mirror,
+            self._add_archive_checkpoints,
+            self._add_run_history,
+            self._add_jira_outbox,
+            self._add_content_hash,
+            self._add_change_sequence,
+            self._add_search_index,
+            self._add_document_files,
+            self._add_backfill_leases,
+            self._add_record_contents,
+            self._split_search_index,
+        ]
+        # Migrations that delete rows or rebuild the booklet table; the DB is backed up first
+        destructive = {self._add_indexes_and_unique_key, self._add_record_contents}
+        self._create_tables()
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if any(migration in destructive for migration in migrations[version:]):
+            self._backup(version)
+        for number, migration in enumerate(migrations, start=1):
+            if version >= number:
+                continue
+            logger.info(f'migrating DB schema to version {number}: {migration.__name__}')
+            with self._transaction():
+                self.conn.execute('BEGIN')
+                migration()
+                self.conn.execute(f'PRAGMA user_version = {number}')
+            if migration in (self._add_record_contents, self._split_search_index):
+                # Give the space of the repeated columns back to the file system
+                logger.info('compacting the DB file')
+                self.conn.execute('VACUUM')
+
+    def _backup(self, version):
+        """Copy the DB, as of schema `version`, next to it before a destructive migration;
+        an empty DB, e.g. one just created, has nothing worth keeping."""
+        if self.conn.execute('SELECT 1 FROM booklet LIMIT 1').fetchone() is None:
+            return
+        backup_path = f'{self.path}.bak-v{version}'
+        logger.warning(f'backing up the DB to {backup_path} before migrating its schema')
+        # The backup API copies a consistent snapshot, WAL included
+        backup = sqlite3.connect(backup_path)
+        try:
+            self.conn.backup(backup)
+        finally:
+            backup.close()
+
+    def _create_tables(self):
+        """Create the original tables, so the migrations can also build a DB from scratch."""
+        with self._transaction():
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS booklet_type
+                (id integer primary key not null, name varchar(30))''')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS booklet
+                (id integer primary key, file_name varchar(200), extension varchar(10),
+                booklet_number integer, number_of_pages smallint, description text,
+                booklet_creation_date varchar(10), modify_date varchar(10), published_date varchar(10),
+                booklet_type integer not null, display_name varchar(200), foreign_year integer,
+                foreign key(booklet_type) references booklet_type(id))''')
+            stored_types = {row['id'] for row in self.conn.execute('SELECT id FROM booklet_type')}
+            self.conn.executemany(
+                'INSERT INTO booklet_type (id, name) VALUES (:id, :name)',
+                [{'id': type_id, 'name': name} for name, type_id in self.booklet_types.items()
+                 if type_id not in stored_types]
+            )
+
     def _ensure_jira_key_column(self):
         cols = {row['name'] for row in self.conn.execute('PRAGMA table_info(booklet)').fetchall()}
         if 'jira_key' not in cols:
-            with self.conn:
-                self.conn.execute('ALTER TABLE booklet ADD COLUMN jira_key TEXT')
+            self.conn.execute('ALTER TABLE booklet ADD COLUMN jira_key TEXT')
+
+    def _add_indexes_and_unique_key(self):
+        # Older runs could store the same entry several times; keep one row per key,
+        # preferring one that already has a Jira issue.
+        duplicates = self.conn.execute('''SELECT id, booklet_type, booklet_number, display_name, jira_key
+            FROM booklet WHERE id NOT IN (
+                SELECT COALESCE(MIN(CASE WHEN jira_key IS NOT NULL THEN id END), MIN(id))
+                FROM booklet GROUP BY booklet_type, booklet_number, display_name)
+            ORDER BY id''').fetchall()
+        if duplicates:
+            logger.warning(f'removing {len(duplicates)} duplicate booklet row(s) before adding the unique key')
+            for row in duplicates:
+                logger.warning(f'  removed row {row["id"]}: type {row["booklet_type"]} #{row["booklet_number"]} '
+                               f'{(row["display_name"] or "")[:80]!r} (jira_key {row["jira_key"]})')
+            self.conn.executemany('DELETE FROM booklet WHERE id = ?', [(row['id'],) for row in duplicates])
+        # The unique key also serves lookups by (booklet_type, booklet_number) as its prefix
+        self.conn.execute('''CREATE UNIQUE INDEX IF NOT EXISTS booklet_type_number_name
+            ON booklet (booklet_type, booklet_number, display_name)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS booklet_number ON booklet (booklet_number)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS booklet_jira_key ON booklet (jira_key)')
+
+    def _add_jira_issue_mirror(self):
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS jira_issue (
+            key TEXT PRIMARY KEY,
+            summary TEXT,
+            normalized_summary TEXT,
+            file_name TEXT,
+            published_date TEXT)''')
+        self.conn.execute('''CREATE INDEX IF NOT EXISTS jira_issue_normalized_summary
+            ON jira_issue (normalized_summary)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jira_issue_file_name ON jira_issue (file_name)')
+        # Small key/value store for sync state such as watermarks
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+
+    def _add_archive_checkpoints(self):
+        # One row per Search API page an --archive crawl has ingested
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS archive_page (
+            booklet_type INTEGER NOT NULL,
+            skip INTEGER NOT NULL,
+            page_size INTEGER NOT NULL,
+            record_count INTEGER NOT NULL,
+            completed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (booklet_type, page_size, skip))''')
+
+    def _add_run_history(self):
+        # One row per run of main.py / backfill_jira_keys.py; `metrics` holds the JSON of
+        # stage durations and counters
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS run (
+            id INTEGER PRIMARY KEY,
+            script TEXT NOT NULL,
+            started_at TEXT NOT NULL,
+            finished_at TEXT NOT NULL,
+            duration_seconds REAL NOT NULL,
+            status TEXT NOT NULL,
+            metrics TEXT NOT NULL)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS run_script_started_at ON run (script, started_at)')
+
+    def _add_jira_outbox(self):
+        # Rows waiting for their Jira issue. A row is queued in the transaction that inserts
+        # it and leaves the queue in the transaction that records its jira_key.
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS jira_outbox (
+            booklet_id INTEGER PRIMARY KEY REFERENCES booklet(id),
+            enqueued_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jira_outbox_next_attempt_at ON jira_outbox (next_attempt_at)')
+
+    def _add_content_hash(self):
+        # cleaner.content_hash() of the stored content; NULL for rows stored before it was
+        # kept, which take the hash of the next version fetched without counting as changed
+        self.conn.execute('ALTER TABLE booklet ADD COLUMN content_hash TEXT')
+
+    def _add_change_sequence(self):
+        # change_seq grows with every insert or change of a row, in commit order, so an
+        # export can pick up where the previous one stopped; triggers keep it up to date
+        # whichever code path writes. Existing rows are numbered by id.
+        self.conn.execute('ALTER TABLE booklet ADD COLUMN change_seq INTEGER')
+        self.conn.execute('UPDATE booklet SET change_seq = id')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS booklet_change_seq ON booklet (change_seq)')
+        next_seq = '(SELECT COALESCE(MAX(change_seq), 0) + 1 FROM booklet)'
+        columns = ['file_name', 'extension', 'booklet_number', 'number_of_pages', 'description',
+                   'booklet_creation_date', 'modify_date', 'published_date', 'booklet_type',
+                   'display_name', 'foreign_year', 'jira_key']
+        self.conn.execute(f'''CREATE TRIGGER IF NOT EXISTS booklet_change_seq_insert
+            AFTER INSERT ON booklet BEGIN
+                UPDATE booklet SET change_seq = {next_seq} WHERE id = NEW.id;
+            END''')
+        self.conn.execute(f'''CREATE TRIGGER IF NOT EXISTS booklet_change_seq_update
+            AFTER UPDATE OF {', '.join(columns)} ON booklet
+            WHEN {' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in columns)} BEGIN
+                UPDATE booklet SET change_seq = {next_seq} WHERE id = NEW.id;
+            END''')
+
+    def _add_search_index(self):
+        # Full-text index of the normalized display_name and description, by booklet id;
+        # Database write methods keep it in sync
+        self.conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS booklet_fts
+            USING fts5(display_name, description, tokenize = 'unicode61')''')
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO booklet_fts (rowid, display_name, description) VALUES (?, ?, ?)',
+            [(row['id'], normalize_hebrew(row['display_name']), normalize_hebrew(row['description']))
+             for row in self.conn.execute('SELECT id, display_name, description FROM booklet')]
+        )
+
+    def _add_document_files(self):
+        # One row per distinct booklet file URL fetched (or attempted) by documents.py; the
+        # file itself is in the content-addressed store under its sha256
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS document_file (
+            file_name TEXT PRIMARY KEY,
+            sha256 TEXT,
+            size INTEGER,
+            page_count INTEGER,
+            fetched_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            error TEXT)''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS document_file_sha256 ON document_file (sha256)')
+
+    def _add_backfill_leases(self):
+        # The booklet_number ranges of a sharded backfill_jira_keys.py run; a worker process
+        # owns a range while its lease is unexpired, so a crashed worker's range is taken over
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS backfill_lease (
+            shard INTEGER PRIMARY KEY,
+            from_booklet INTEGER NOT NULL,
+            to_booklet INTEGER NOT NULL,
+            owner TEXT,
+            expires_at TEXT,
+            done_at TEXT)''')
+
+    def _add_record_contents(self):
+        # Every entry of an API record repeated its file, dates, page count and (often long)
+        # description. Those move to the record_content table, one row per distinct
+        # content_hash, which booklet rows reference; the booklet_full view joins them back into
+        # the old layout. Rows from before content hashes were kept get one record_content row
+        # per distinct content, without a hash, so they are still treated as unhashed.
+        columns = ', '.join(RECORD_CONTENT_COLUMNS)
+        self.conn.execute('''CREATE TABLE record_content (
+            id INTEGER PRIMARY KEY,
+            content_hash TEXT UNIQUE,
+            file_name TEXT,
+            extension TEXT,
+            number_of_pages INTEGER,
+            description TEXT,
+            booklet_creation_date TEXT,
+            modify_date TEXT,
+            published_date TEXT,
+            foreign_year INTEGER)''')
+        self.conn.execute(f'''INSERT INTO record_content (content_hash, {columns})
+            SELECT content_hash, {columns} FROM booklet WHERE content_hash IS NOT NULL
+            GROUP BY content_hash ORDER BY MIN(id)''')
+        self.conn.execute(f'''INSERT INTO record_content ({columns})
+            SELECT {columns} FROM booklet WHERE content_hash IS NULL
+            GROUP BY {columns} ORDER BY MIN(id)''')
+
+        self.conn.execute('''CREATE TABLE booklet_entry (
+            id INTEGER PRIMARY KEY,
+            content_id INTEGER NOT NULL REFERENCES record_content(id),
+            booklet_type INTEGER NOT NULL REFERENCES booklet_type(id),
+            booklet_number INTEGER,
+            display_name TEXT,
+            jira_key TEXT,
+            change_seq INTEGER)''')
+        entry_columns = 'id, content_id, booklet_type, booklet_number, display_name, jira_key, change_seq'
+        selected = ('booklet.id, record_content.id, booklet.booklet_type, booklet.booklet_number, '
+                    'booklet.display_name, booklet.jira_key, booklet.change_seq')
+        self.conn.execute(f'''INSERT INTO booklet_entry ({entry_columns}) SELECT {selected}
+            FROM booklet JOIN record_content ON record_content.content_hash = booklet.content_hash''')
+        # Only needed to match the unhashed rows to their record_content rows
+        self.conn.execute('CREATE INDEX record_content_file_name ON record_content (file_name)')
+        same_content = ' AND '.join(f'record_content.{column} IS booklet.{column}'
+                                    for column in RECORD_CONTENT_COLUMNS)
+        self.conn.execute(f'''INSERT INTO booklet_entry ({entry_columns}) SELECT {selected}
+            FROM booklet JOIN record_content ON record_content.content_hash IS NULL AND {same_content}
+            WHERE booklet.content_hash IS NULL''')
+        self.conn.execute('DROP INDEX record_content_file_name')
+
+        # Dropping the table drops its indexes and triggers too; jira_outbox and booklet_fts
+        # refer to rows by id, which is kept
+        self.conn.execute('DROP TABLE booklet')
+        self.conn.execute('ALTER TABLE booklet_entry RENAME TO booklet')
+        self.conn.execute('''CREATE UNIQUE INDEX booklet_type_number_name
+            ON booklet (booklet_type, booklet_number, display_name)''')
+        self.conn.execute('CREATE INDEX booklet_number ON booklet (booklet_number)')
+        self.conn.execute('CREATE INDEX booklet_jira_key ON booklet (jira_key)')
+        self.conn.execute('CREATE INDEX booklet_change_seq ON booklet (change_seq)')
+        self.conn.execute('CREATE INDEX booklet_content_id ON booklet (content_id)')
+
+        # A change of content now shows as a new content_id
+        next_seq = '(SELECT COALESCE(MAX(change_seq), 0) + 1 FROM booklet)'
+        columns = ['content_id', 'booklet_type', 'booklet_number', 'display_name', 'jira_key']
+        self.conn.execute(f'''CREATE TRIGGER booklet_change_seq_insert
+            AFTER INSERT ON booklet BEGIN
+                UPDATE booklet SET change_seq = {next_seq} WHERE id = NEW.id;
+            END''')
+        self.conn.execute(f'''CREATE TRIGGER booklet_change_seq_update
+            AFTER UPDATE OF {', '.join(columns)} ON booklet
+            WHEN {' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in columns)} BEGIN
+                UPDATE booklet SET change_seq = {next_seq} WHERE id = NEW.id;
+            END''')
+        # record_content rows are replaced rather than changed; drop those no row refers to any more
+        unreferenced = ('DELETE FROM record_content WHERE id = OLD.content_id '
+                        'AND NOT EXISTS (SELECT 1 FROM booklet WHERE content_id = OLD.content_id)')
+        self.conn.execute(f'''CREATE TRIGGER booklet_content_update
+            AFTER UPDATE OF content_id ON booklet WHEN OLD.content_id IS NOT NEW.content_id BEGIN
+                {unreferenced};
+            END''')
+        self.conn.execute(f'''CREATE TRIGGER booklet_content_delete
+            AFTER DELETE ON booklet BEGIN
+                {unreferenced};
+            END''')
+
+        self.conn.execute(f'''CREATE VIEW booklet_full AS
+            SELECT booklet.id, {', '.join(f'record_content.{column}' for column in RECORD_CONTENT_COLUMNS)},
+                booklet.booklet_type, booklet.booklet_number, booklet.display_name, booklet.jira_key,
+                record_content.content_hash, booklet.change_seq, booklet.content_id
+            FROM booklet JOIN record_content ON record_content.id = booklet.content_id''')
+
+    def _split_search_index(self):
+        # booklet_fts still held a copy of the description for every entry. The description
+        # is now indexed once per record_content row, in record_content_fts, next to
+        # booklet_name_fts for the display names; search() looks in both. Database write methods keep them in sync,
+        # and the triggers drop the index entries of deleted rows.
+        self.conn.execute('DROP TABLE booklet_fts')
+        self.conn.execute('''CREATE VIRTUAL TABLE booklet_name_fts
+            USING fts5(display_name, tokenize = 'unicode61')''')
+        self.conn.execute('''CREATE VIRTUAL TABLE record_content_fts
+            USING fts5(description, tokenize = 'unicode61')''')
+        self._index_names(dict(row) for row in self.conn.execute('SELECT id, display_name FROM booklet'))
+        self._index_descriptions(self.conn.execute('SELECT id, description FROM record_content'))
+        self.conn.execute('''CREATE TRIGGER booklet_name_fts_delete
+            AFTER DELETE ON booklet BEGIN
+                DELETE FROM booklet_name_fts WHERE rowid = OLD.id;
+            END''')
+        self.conn.execute('''CREATE TRIGGER record_content_fts_delete
+            AFTER DELETE ON record_content BEGIN
+                DELETE FROM record_content_fts WHERE rowid = OLD.id;
+            END''')
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.conn.close()
 
+    _insert_record_content_sql = '''INSERT INTO record_content
+        (content_hash, file_name, extension, number_of_pages, description, booklet_creation_date,
+        modify_date, published_date, foreign_year)
+        VALUES (:content_hash, :file_name, :extension, :number_of_pages, :description, :creation_date,
+        :modify_date, :published_date, :foreign_year)
+        ON CONFLICT (content_hash) DO NOTHING'''
+
+    _content_id = '(SELECT id FROM record_content WHERE content_hash = :content_hash)'
+
+    _insert_sql = f'''INSERT INTO booklet (content_id, booklet_type, booklet_number, display_name)
+        VALUES ({_content_id}, :booklet_type_id, :booklet_number, :display_name)
+        ON CONFLICT (booklet_type, booklet_number, display_name) DO NOTHING'''
+
+    _update_sql = f'UPDATE booklet SET content_id = {_content_id} WHERE id = :id'
+
+    def _store_record_contents(self, items):
+        """Insert the record_content rows of cleaned items that aren't stored yet, and index their
+        descriptions. Returns the items, each with the content_hash that refers to its row."""
+        items = [item if item.get('content_hash') else dict(item, content_hash=content_hash(item))
+                 for item in items]
+        last_id = self.conn.execute('SELECT COALESCE(MAX(id), 0) FROM record_content').fetchone()[0]
+        self.conn.executemany(self._insert_record_content_sql, items)
+        self._index_descriptions(self.conn.execute(
+            'SELECT id, description FROM record_content WHERE id > :last_id', {'last_id': last_id}))
+        return items
+
+    def _drop_unused_record_contents(self, items):
+        """Delete the record_content rows _store_record_contents() added for items that were then
+        not inserted."""
+        self.conn.executemany(
+            'DELETE FROM record_content WHERE content_hash = :content_hash '
+            'AND NOT EXISTS (SELECT 1 FROM booklet WHERE content_id = record_content.id)',
+            [{'content_hash': item['content_hash']} for item in items]
+        )
+
     def insert_item(self, item_type, item):
-        with self.conn:
-            cursor = self.conn.execute(f'''INSERT INTO booklet
-                (file_name, extension, booklet_number, number_of_pages, description,
-                booklet_creation_date, modify_date, published_date, booklet_type,
-                display_name, foreign_year)
-                VALUES (:file_name, :extension, :booklet_number, :number_of_pages, :description,
-                :creation_date, :modify_date, :published_date, {item_type}, :display_name,
-                :foreign_year)''', item)
-            return cursor.lastrowid
+        """Insert a cleaned item and return its row id, or None if an entry with the same
+        (booklet_type, booklet_number, display_name) is already stored."""
+        with self._transaction():
+            [item] = self._store_record_contents([item])
+            row = self.conn.execute(f'{self._insert_sql} RETURNING id',
+                                    dict(item, booklet_type_id=item_type)).fetchone()
+            if row:
+                self._index_names([dict(item, id=row['id'])])
+            else:
+                self._drop_unused_record_contents([item])
+            return row['id'] if row else None
+
+    def insert_items(self, items, enqueue=False):
+        """Insert a batch of cleaned items of any type in a single transaction.
+        With `enqueue`, the new rows are also queued in the Jira outbox, in the same transaction.
+        Returns the new row id of each item, in order, with None for items already stored."""
+        items = list(items)
+        if not items:
+            return []
+        with self._transaction():
+            # Take the write lock up front so no other writer can add rows between
+            # reading the current max id and collecting the ids of our inserts.
+            self.conn.execute('BEGIN IMMEDIATE')
+            ids = self._insert_items(items)
+            if enqueue:
+                self._enqueue_jira(row_id for row_id in ids if row_id is not None)
+            return ids
+
+    def _insert_items(self, items):
+        """insert_items without the transaction handling, for callers that write more in the same one."""
+        last_id = self.conn.execute('SELECT COALESCE(MAX(id), 0) FROM booklet').fetchone()[0]
+        items = self._store_record_contents(items)
+        self.conn.executemany(self._insert_sql, [
+            dict(item, booklet_type_id=self.booklet_types[item['booklet_type']]) for item in items
+        ])
+        rows = self.conn.execute(
+            'SELECT id, booklet_type, booklet_number, display_name FROM booklet WHERE id > :last_id',
+            {'last_id': last_id}
+        ).fetchall()
+        new_ids = {(row['booklet_type'], int(row['booklet_number']), row['display_name']): row['id']
+                   for row in rows}
+        ids = [new_ids.get((self.booklet_types[item['booklet_type']], int(item['booklet_number']),
+                            item['display_name']))
+               for item in items]
+        self._index_names(dict(item, id=row_id) for item, row_id in zip(items, ids) if row_id is not None)
+        self._drop_unused_record_contents(item for item, row_id in zip(items, ids) if row_id is None)
+        return ids
+
+    def classify_items(self, item_type, items, min_booklet_number=None):
+        """Sort a batch of cleaned items of one type against the stored rows, in SQL.
+
+        The batch is staged in a temp table, deduplicated by (booklet_number, display_name)
+        keeping the last occurrence, and anti-joined with the booklet table over its unique
+        key, so the work depends on the size of the batch, not of the history.
+        Returns (new, changed, unhashed):
+        - new: entries not stored yet, with a booklet_number of at least `min_booklet_number`
+          (None for no limit)
+        - changed: stored entries whose content_hash differs
+        - unhashed: stored entries from before content hashes were kept
+        Changed and unhashed items are copies with the `id` and `jira_key` of their row."""
+        items = list(items)
+        if not items:
+            return [], [], []
+        with self._transaction():
+            self.conn.execute('''CREATE TEMP TABLE IF NOT EXISTS booklet_stage (
+                seq INTEGER PRIMARY KEY,
+                booklet_number INTEGER NOT NULL,
+                display_name TEXT NOT NULL,
+                content_hash TEXT)''')
+            self.conn.execute('DELETE FROM temp.booklet_stage')
+            self.conn.executemany(
+                'INSERT INTO temp.booklet_stage (seq, booklet_number, display_name, content_hash) '
+                'VALUES (:seq, :booklet_number, :display_name, :content_hash)',
+                [{'seq': seq, 'booklet_number': int(item['booklet_number']),
+                  'display_name': item['display_name'], 'content_hash': item['content_hash']}
+                 for seq, item in enumerate(items)]
+            )
+            # With MAX(), SQLite takes the bare content_hash from the row holding the maximum
+            rows = self.conn.execute(
+                '''SELECT staged.seq, booklet.id, record_content.content_hash, booklet.jira_key
+                FROM (SELECT MAX(seq) AS seq, booklet_number, display_name, content_hash
+                      FROM temp.booklet_stage GROUP BY booklet_number, display_name) AS staged
+                LEFT JOIN booklet ON booklet.booklet_type = :booklet_type
+                    AND booklet.booklet_number = staged.booklet_number
+                    AND booklet.display_name = staged.display_name
+                LEFT JOIN record_content ON record_content.id = booklet.content_id
+                WHERE (booklet.id IS NULL
+                       AND (:min_booklet_number IS NULL OR staged.booklet_number >= :min_booklet_number))
+                   OR (booklet.id IS NOT NULL AND record_content.content_hash IS NOT staged.content_hash)
+                ORDER BY staged.seq''',
+                {'booklet_type': item_type, 'min_booklet_number': min_booklet_number}
+            ).fetchall()
+        new, changed, unhashed = [], [], []
+        for row in rows:
+            item = items[row['seq']]
+            if row['id'] is None:
+                new.append(item)
+                continue
+            item = dict(item, id=row['id'], jira_key=row['jira_key'])
+            (unhashed if row['content_hash'] is None else changed).append(item)
+        return new, changed, unhashed
+
+    def update_items(self, items):
+        """Overwrite the content of stored rows with cleaned items that carry their row `id`,
+        in a single transaction."""
+        items = list(items)
+        with self._transaction():
+            items = self._store_record_contents(items)
+            self.conn.executemany(self._update_sql, items)
+
+    def _index_names(self, items):
+        """Add the booklet_name_fts entries of new rows, given as dicts with id and display_name.
+        Every insert of a row goes through here, within its transaction."""
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO booklet_name_fts (rowid, display_name) VALUES (:id, :display_name)',
+            [{'id': item['id'], 'display_name': normalize_hebrew(item['display_name'])} for item in items]
+        )
+
+    def _index_descriptions(self, rows):
+        """Add the record_content_fts entries of new record_content rows, given as rows of id and
+        description."""
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO record_content_fts (rowid, description) VALUES (?, ?)',
+            [(row['id'], normalize_hebrew(row['description'])) for row in rows]
+        )
+
+    def search(self, query, item_type=None, published_from=None, published_to=None, limit=20):
+        """Full-text search over display_name and description, best matches first.
+
+        The query is normalized like the index (see cleaner.normalize_hebrew) and every word
+        must match, in either field, the last one also as a prefix. Rows where all the words
+        are in one field rank first, by bm25, with matches in display_name weighing more than
+        in description. `published_from` and `published_to` are inclusive YYYY-MM-DD dates.
+        Returns the matching rows as plain dicts, with their `rank` (lower is better)."""
+        words = normalize_hebrew(query).split()
+        if not words:
+            return []
+        terms = {f'word{i}': f'"{word}"' for i, word in enumerate(words)}
+        terms[f'word{len(words) - 1}'] += '*'
+        # Display names are indexed by booklet id, descriptions by record_content id
+        matched = ' INTERSECT '.join(
+            f'''SELECT id FROM (
+                SELECT rowid AS id FROM booklet_name_fts WHERE booklet_name_fts MATCH :{term}
+                UNION
+                SELECT booklet.id FROM record_content_fts
+                JOIN booklet ON booklet.content_id = record_content_fts.rowid
+                WHERE record_content_fts MATCH :{term})'''
+            for term in terms
+        )
+        rows = self.conn.execute(
+            f'''WITH matched (id) AS ({matched}),
+            ranked (id, rank) AS (
+                SELECT rowid, 10.0 * bm25(booklet_name_fts) FROM booklet_name_fts
+                WHERE booklet_name_fts MATCH :match
+                UNION ALL
+                SELECT booklet.id, bm25(record_content_fts) FROM record_content_fts
+                JOIN booklet ON booklet.content_id = record_content_fts.rowid
+                WHERE record_content_fts MATCH :match
+                UNION ALL
+                SELECT id, 0 FROM matched)
+            SELECT booklet.*, scored.rank FROM (SELECT id, SUM(rank) AS rank FROM ranked GROUP BY id) AS scored
+            JOIN booklet_full AS booklet ON booklet.id = scored.id
+            WHERE (:booklet_type IS NULL OR booklet.booklet_type = :booklet_type)
+                AND (:published_from IS NULL OR substr(booklet.published_date, 1, 10) >= :published_from)
+                AND (:published_to IS NULL OR substr(booklet.published_date, 1, 10) <= :published_to)
+            ORDER BY scored.rank LIMIT :limit''',
+            dict(terms, match=' '.join(terms.values()), booklet_type=item_type,
+                 published_from=published_from, published_to=published_to, limit=limit)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def insert_archive_page(self, item_type, skip, page_size, record_count, items):
+        """Insert the cleaned items of one archive page and checkpoint the page, atomically,
+        so a crawl interrupted at any point resumes without losing or repeating a page.
+        Returns the new row ids as insert_items does."""
+        with self._transaction():
+            self.conn.execute('BEGIN IMMEDIATE')
+            ids = self._insert_items(items) if items else []
+            self.conn.execute(
+                'INSERT OR REPLACE INTO archive_page (booklet_type, skip, page_size, record_count) '
+                'VALUES (:booklet_type, :skip, :page_size, :record_count)',
+                {'booklet_type': item_type, 'skip': skip, 'page_size': page_size, 'record_count': record_count}
+            )
+            return ids
+
+    def get_archived_pages(self, item_type, page_size):
+        """Return {skip: record_count} for the archive pages of this type already ingested."""
+        rows = self.conn.execute(
+            'SELECT skip, record_count FROM archive_page '
+            'WHERE booklet_type = :booklet_type AND page_size = :page_size',
+            {'booklet_type': item_type, 'page_size': page_size}
+        ).fetchall()
+        return {row['skip']: row['record_count'] for row in rows}
+
+    def clear_archive_pages(self, item_type=None):
+        """Forget archive checkpoints, for one type or all, so the next crawl starts over."""
+        with self._transaction():
+            if item_type is None:
+                self.conn.execute('DELETE FROM archive_page')
+            else:
+                self.conn.execute('DELETE FROM archive_page WHERE booklet_type = :booklet_type',
+                                  {'booklet_type': item_type})
 
     def insert_takana(self, takana):
         return self.insert_item(self.booklet_types['takana'], takana)
@@ -46,7 +625,8 @@ class Database:
     def get_last_of_type(self, item_type):
         with self.conn:
             return self.conn.execute(f'''SELECT id, file_name, booklet_number, booklet_creation_date
-            FROM booklet WHERE booklet_type = {item_type} ORDER BY id DESC LIMIT 1''').fetchone()
+            FROM booklet_full WHERE booklet_type = {item_type}
+            ORDER BY booklet_number DESC, id DESC LIMIT 1''').fetchone()
 
     def get_last_law(self):
         return self.get_last_of_type(self.booklet_types['law'])
@@ -59,7 +639,7 @@ class Database:
 
     def get_type(self, booklet_type, booklet_number):
         return self.conn.execute(f'''SELECT id, file_name, booklet_number, booklet_creation_date
-        FROM booklet
+        FROM booklet_full
         WHERE booklet_type = {booklet_type} AND booklet_number = :booklet_number''',
                                  {'booklet_number': booklet_number}).fetchone()
 
@@ -76,7 +656,7 @@ class Database:
         """Record the Jira issue key for a stored booklet. booklet_type may be int or string."""
         if isinstance(booklet_type, str):
             booklet_type = self.booklet_types[booklet_type]
-        with self.conn:
+        with self._transaction():
             self.conn.execute(
                 'UPDATE booklet SET jira_key = :jira_key '
                 'WHERE booklet_number = :booklet_number AND booklet_type = :booklet_type',
@@ -85,50 +665,294 @@ class Database:
 
     def update_jira_key_by_id(self, row_id, jira_key):
         """Record the Jira issue key for a specific row by its primary key."""
-        with self.conn:
+        with self._transaction():
             self.conn.execute(
                 'UPDATE booklet SET jira_key = :jira_key WHERE id = :id',
                 {'jira_key': jira_key, 'id': row_id}
             )
 
-    def get_all_without_jira_key(self, from_booklet=None):
+    def update_jira_keys_by_id(self, keys):
+        """Record many (row_id, jira_key) pairs in a single transaction."""
+        with self._transaction():
+            self.conn.executemany(
+                'UPDATE booklet SET jira_key = :jira_key WHERE id = :id',
+                [{'id': row_id, 'jira_key': jira_key} for row_id, jira_key in keys]
+            )
+
+    def get_all_without_jira_key(self, from_booklet=None, to_booklet=None):
         """Return all rows (any type) that have no jira_key yet, ordered by booklet_number.
-        Optionally restrict to booklet_number >= from_booklet."""
+        Optionally restrict to from_booklet <= booklet_number <= to_booklet."""
+        where = 'jira_key IS NULL'
         if from_booklet is not None:
+            where += ' AND booklet_number >= :from_booklet'
+        if to_booklet is not None:
+            where += ' AND booklet_number <= :to_booklet'
+        rows = self.conn.execute(
+            f'SELECT * FROM booklet_full WHERE {where} ORDER BY booklet_number DESC',
+            {'from_booklet': from_booklet, 'to_booklet': to_booklet}
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def plan_backfill_shards(self, ranges):
+        """Replace the shards of the previous sharded backfill with the inclusive
+        (from_booklet, to_booklet) `ranges`. Returns False, changing nothing, while a shard
+        of another run is still leased."""
+        with self._transaction():
+            self.conn.execute('BEGIN IMMEDIATE')
+            leased = self.conn.execute(
+                "SELECT 1 FROM backfill_lease WHERE done_at IS NULL AND expires_at > datetime('now')"
+            ).fetchone()
+            if leased:
+                return False
+            self.conn.execute('DELETE FROM backfill_lease')
+            self.conn.executemany(
+                'INSERT INTO backfill_lease (shard, from_booklet, to_booklet) VALUES (:shard, :from_booklet, :to_booklet)',
+                [{'shard': shard, 'from_booklet': first, 'to_booklet': last}
+                 for shard, (first, last) in enumerate(ranges)]
+            )
+        return True
+
+    def claim_backfill_shard(self, owner, lease_seconds):
+        """Lease the next unfinished shard that nobody holds (or whose lease expired) to
+        `owner`, for `lease_seconds`. Returns the shard's row, or None when none is left."""
+        with self._transaction():
+            # A single UPDATE, so two workers can never claim the same shard
             rows = self.conn.execute(
-                'SELECT * FROM booklet WHERE jira_key IS NULL AND booklet_number >= :from_booklet '
-                'ORDER BY booklet_number DESC',
-                {'from_booklet': from_booklet}
-            ).fetchall()
-        else:
-            rows = self.conn.execute(
-                'SELECT * FROM booklet WHERE jira_key IS NULL ORDER BY booklet_number DESC'
+                '''UPDATE backfill_lease SET owner = :owner,
+                expires_at = datetime('now', '+' || :lease_seconds || ' seconds')
+                WHERE shard = (
+                    SELECT shard FROM backfill_lease
+                    WHERE done_at IS NULL AND (expires_at IS NULL OR expires_at <= datetime('now'))
+                    ORDER BY shard LIMIT 1)
+                RETURNING *''',
+                {'owner': owner, 'lease_seconds': lease_seconds}
             ).fetchall()
-        return [dict(row) for row in rows]
+        return rows[0] if rows else None
+
+    def renew_backfill_lease(self, shard, owner, lease_seconds):
+        """Extend `owner`'s lease on `shard`. Returns False if it has been lost to another worker."""
+        with self._transaction():
+            cur = self.conn.execute(
+                '''UPDATE backfill_lease SET expires_at = datetime('now', '+' || :lease_seconds || ' seconds')
+                WHERE shard = :shard AND owner = :owner AND done_at IS NULL''',
+                {'shard': shard, 'owner': owner, 'lease_seconds': lease_seconds}
+            )
+        return cur.rowcount > 0
+
+    def finish_backfill_shard(self, shard, owner):
+        with self._transaction():
+            self.conn.execute(
+                '''UPDATE backfill_lease SET done_at = CURRENT_TIMESTAMP, expires_at = NULL
+                WHERE shard = :shard AND owner = :owner''',
+                {'shard': shard, 'owner': owner}
+            )
 
     def get_full_by_booklet_number(self, booklet_number):
         """Return all DB rows (any type) matching booklet_number, as plain dicts."""
         rows = self.conn.execute(
-            'SELECT * FROM booklet WHERE booklet_number = :booklet_number',
+            'SELECT * FROM booklet_full WHERE booklet_number = :booklet_number',
             {'booklet_number': booklet_number}
         ).fetchall()
         return [dict(row) for row in rows]
 
-    def get_all_entries_of_type(self, item_type):
-        """Return a set of (booklet_number, display_name) tuples for all stored rows of this type.
-        Used to detect true duplicates: same booklet AND same law title."""
-        with self.conn:
+    def get_full_by_booklet_ranges(self, ranges):
+        """Return all DB rows (any type) whose booklet_number is in one of the inclusive
+        (first, last) ranges, as plain dicts ordered by booklet_number, in a single query."""
+        ranges = list(ranges)
+        if not ranges:
+            return []
+        where = ' OR '.join(f'booklet_number BETWEEN :first_{i} AND :last_{i}' for i in range(len(ranges)))
+        params = {}
+        for i, (first, last) in enumerate(ranges):
+            params[f'first_{i}'] = first
+            params[f'last_{i}'] = last
+        rows = self.conn.execute(
+            f'SELECT * FROM booklet_full WHERE {where} ORDER BY booklet_number, id', params
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def _enqueue_jira(self, row_ids):
+        """Queue stored rows for delivery to Jira, within the transaction that inserts them;
+        rows already queued become due right away."""
+        self.conn.executemany(
+            'INSERT INTO jira_outbox (booklet_id) VALUES (:id) '
+            'ON CONFLICT (booklet_id) DO UPDATE SET next_attempt_at = CURRENT_TIMESTAMP',
+            [{'id': row_id} for row_id in row_ids]
+        )
+
+    def get_due_jira_deliveries(self, limit):
+        """Return up to `limit` queued rows whose next attempt is due, oldest first, as plain
+        dicts of their booklet columns plus the outbox `attempts`."""
+        rows = self.conn.execute(
+            '''SELECT booklet.*, jira_outbox.attempts FROM jira_outbox
+            JOIN booklet_full AS booklet ON booklet.id = jira_outbox.booklet_id
+            WHERE jira_outbox.next_attempt_at <= CURRENT_TIMESTAMP
+            ORDER BY jira_outbox.booklet_id LIMIT :limit''',
+            {'limit': limit}
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def claim_jira_deliveries(self, limit, lease_seconds):
+        """Take up to `limit` due rows off the queue for `lease_seconds`, oldest first, and
+        return them like get_due_jira_deliveries(). Until the lease runs out, no other drain
+        gets them; completing or retrying them ends it, and a crashed drain's rows come due
+        again once it expires."""
+        with self._transaction():
+            # A single UPDATE, so two drains can never claim the same row
+            self.conn.execute('BEGIN IMMEDIATE')
+            claimed = self.conn.execute(
+                '''UPDATE jira_outbox SET next_attempt_at = datetime('now', '+' || :lease_seconds || ' seconds')
+                WHERE booklet_id IN (
+                    SELECT booklet_id FROM jira_outbox WHERE next_attempt_at <= CURRENT_TIMESTAMP
+                    ORDER BY booklet_id LIMIT :limit)
+                RETURNING booklet_id''',
+                {'limit': limit, 'lease_seconds': lease_seconds}
+            ).fetchall()
             rows = self.conn.execute(
-                f'SELECT booklet_number, display_name FROM booklet WHERE booklet_type = {item_type}'
+                f'''SELECT booklet.*, jira_outbox.attempts FROM jira_outbox
+                JOIN booklet_full AS booklet ON booklet.id = jira_outbox.booklet_id
+                WHERE jira_outbox.booklet_id IN ({', '.join('?' * len(claimed))})
+                ORDER BY jira_outbox.booklet_id''',
+                [row['booklet_id'] for row in claimed]
             ).fetchall()
-            return {(int(row['booklet_number']), row['display_name']) for row in rows}
+        return [dict(row) for row in rows]
+
+    def complete_jira_deliveries(self, keys):
+        """Record many (row_id, jira_key) pairs and take those rows off the outbox, atomically."""
+        keys = [{'id': row_id, 'jira_key': jira_key} for row_id, jira_key in keys]
+        with self._transaction():
+            self.conn.executemany('UPDATE booklet SET jira_key = :jira_key WHERE id = :id', keys)
+            self.conn.executemany('DELETE FROM jira_outbox WHERE booklet_id = :id', keys)
+
+    def retry_jira_deliveries(self, row_ids, base_delay, max_delay):
+        """Count a failed attempt for each row and postpone its next one exponentially:
+        `base_delay` seconds after the first failure, doubling up to `max_delay`."""
+        with self._transaction():
+            self.conn.executemany(
+                '''UPDATE jira_outbox SET attempts = attempts + 1,
+                next_attempt_at = datetime('now', '+' || min(:base_delay << min(attempts, 20), :max_delay) || ' seconds')
+                WHERE booklet_id = :id''',
+                [{'id': row_id, 'base_delay': base_delay, 'max_delay': max_delay} for row_id in row_ids]
+            )
+
+    def reset_jira_retry_delays(self):
+        """Make every queued row due right away."""
+        with self._transaction():
+            self.conn.execute('UPDATE jira_outbox SET next_attempt_at = CURRENT_TIMESTAMP')
+
+    def get_jira_outbox_status(self):
+        """Return (number of queued rows, enqueued_at of the oldest, most attempts of any)."""
+        row = self.conn.execute(
+            'SELECT COUNT(*), MIN(enqueued_at), COALESCE(MAX(attempts), 0) FROM jira_outbox'
+        ).fetchone()
+        return row[0], row[1], row[2]
+
+    def iter_export_rows(self, after_seq=0, batch_size=1000):
+        """Yield the booklet rows changed after `after_seq`, with their type name, as plain dicts
+        in change_seq order. Rows are read from the cursor `batch_size` at a time, so memory
+        stays flat whatever the size of the table."""
+        cursor = self.conn.execute(
+            '''SELECT booklet.*, booklet_type.name AS booklet_type_name FROM booklet_full AS booklet
+            JOIN booklet_type ON booklet_type.id = booklet.booklet_type
+            WHERE booklet.change_seq > :after_seq ORDER BY booklet.change_seq''',
+            {'after_seq': after_seq}
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+
+    def get_documents_to_fetch(self, file_names=None, limit=None):
+        """Return the distinct booklet files not stored yet (including earlier failures), newest
+        booklet first, as dicts of file_name and the number_of_pages the API gave for it.
+        `file_names` restricts them to those files."""
+        where = 'booklet.file_name IS NOT NULL AND document_file.sha256 IS NULL'
+        params = {'limit': -1 if limit is None else limit}
+        if file_names is not None:
+            file_names = sorted(set(file_names))
+            if not file_names:
+                return []
+            where += f' AND booklet.file_name IN ({", ".join(f":file_{i}" for i in range(len(file_names)))})'
+            params.update((f'file_{i}', file_name) for i, file_name in enumerate(file_names))
+        rows = self.conn.execute(
+            f'''SELECT booklet.file_name, MAX(booklet.number_of_pages) AS number_of_pages
+            FROM booklet_full AS booklet LEFT JOIN document_file ON document_file.file_name = booklet.file_name
+            WHERE {where}
+            GROUP BY booklet.file_name ORDER BY MAX(booklet.booklet_number) DESC LIMIT :limit''',
+            params
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def record_document(self, file_name, sha256=None, size=None, page_count=None, error=None):
+        """Record the outcome of fetching a booklet file: where it is stored, or why it isn't."""
+        with self._transaction():
+            self.conn.execute(
+                '''INSERT INTO document_file (file_name, sha256, size, page_count, error)
+                VALUES (:file_name, :sha256, :size, :page_count, :error)
+                ON CONFLICT (file_name) DO UPDATE SET sha256 = excluded.sha256, size = excluded.size,
+                page_count = excluded.page_count, error = excluded.error,
+                fetched_at = CURRENT_TIMESTAMP''',
+                {'file_name': file_name, 'sha256': sha256, 'size': size, 'page_count': page_count,
+                 'error': error}
+            )
+
+    def get_document_file(self, file_name):
+        """Return the document_file row of a booklet file URL, or None."""
+        return self.conn.execute(
+            'SELECT * FROM document_file WHERE file_name = :file_name', {'file_name': file_name}
+        ).fetchone()
 
-    def get_all_law_entries(self):
-        return self.get_all_entries_of_type(self.booklet_types['law'])
+    def get_meta(self, name, default=None):
+        row = self.conn.execute('SELECT value FROM meta WHERE name = :name', {'name': name}).fetchone()
+        return row['value'] if row else default
 
-    def get_all_takana_entries(self):
-        return self.get_all_entries_of_type(self.booklet_types['takana'])
+    def set_meta(self, name, value):
+        with self._transaction():
+            self.conn.execute(
+                'INSERT INTO meta (name, value) VALUES (:name, :value) '
+                'ON CONFLICT (name) DO UPDATE SET value = excluded.value',
+                {'name': name, 'value': value}
+            )
+
+    def upsert_jira_issues(self, issues):
+        """Store or refresh mirrored Jira issues, given as dicts with key, summary,
+        normalized_summary, file_name and published_date, in a single transaction."""
+        with self._transaction():
+            self.conn.executemany(
+                '''INSERT INTO jira_issue (key, summary, normalized_summary, file_name, published_date)
+                VALUES (:key, :summary, :normalized_summary, :file_name, :published_date)
+                ON CONFLICT (key) DO UPDATE SET summary = excluded.summary,
+                normalized_summary = excluded.normalized_summary, file_name = excluded.file_name,
+                published_date = excluded.published_date''',
+                issues
+            )
+
+    def get_jira_issues_by_summary(self, normalized_summary):
+        """Return the mirrored issues whose normalized summary equals normalized_summary."""
+        rows = self.conn.execute(
+            'SELECT * FROM jira_issue WHERE normalized_summary = :normalized_summary',
+            {'normalized_summary': normalized_summary}
+        ).fetchall()
+        return [dict(row) for row in rows]
 
-    def get_all_notification_entries(self):
-        return self.get_all_entries_of_type(self.booklet_types['notification'])
+    def get_jira_issues_by_file_name(self, file_name):
+        """Return the mirrored issues whose customfield_11689 equals file_name."""
+        rows = self.conn.execute(
+            'SELECT * FROM jira_issue WHERE file_name = :file_name', {'file_name': file_name}
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_jira_issues(self):
+        return self.conn.execute('SELECT COUNT(*) FROM jira_issue').fetchone()[0]
+
+    def insert_run(self, script, started_at, finished_at, duration_seconds, status, metrics_json):
+        with self._transaction():
+            self.conn.execute(
+                'INSERT INTO run (script, started_at, finished_at, duration_seconds, status, metrics) '
+                'VALUES (:script, :started_at, :finished_at, :duration_seconds, :status, :metrics)',
+                {'script': script, 'started_at': started_at, 'finished_at': finished_at,
+                 'duration_seconds': duration_seconds, 'status': status, 'metrics': metrics_json}
+            )
 
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Download the booklet PDFs into a local, content-addressed store.
+
+Every row's file_name is the URL of its gazette PDF, and many rows (one per
+display name) share one file. Each distinct URL is downloaded once, over a
+pooled session with several downloads in flight, and stored under the SHA-256
+of its content, so identical files are kept once whatever their URL:
+
+    document_store/ab/ab12...ef.pdf
+
+The document_file table maps each URL to its hash; local_path() gives the file
+of a URL, so other tools can read the local copy instead of the government
+server. An interrupted download is resumed with an HTTP range request on the
+next run, made conditional with If-Range on the ETag or Last-Modified the
+download started with, so a file replaced on the server in the meantime is
+downloaded again from the start rather than appended to the old one. The page
+count of each PDF is checked against the number_of_pages the API gave for it,
+and mismatches are logged.
+
+main.py runs this for the booklets it inserts when given --fetch-documents;
+run this script to fetch the older ones.
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import logging
+import os
+import re
+from contextlib import nullcontext
+
+import requests
+
+import database
+import metrics
+from scraper import DEFAULT_TIMEOUT, STREAM_CHUNK_SIZE, make_session
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_DIR = 'document_store'
+DEFAULT_WORKERS = 4
+
+# Counting pages without a PDF library: every page object is a '/Type /Page' dictionary,
+# unless it sits in a compressed object stream. Then only the page tree root's /Count
+# might still be readable; if neither is, the count is unknown.
+_PAGE_OBJECT = re.compile(rb'/Type\s*/Page(?![A-Za-z])')
+_CONTENT_RANGE_START = re.compile(r'bytes (\d+)-')
+_CONTENT_RANGE_UNSATISFIED = re.compile(r'bytes \*/(\d+)$')
+_PAGE_TREE_COUNT = re.compile(rb'/Type\s*/Pages(?![A-Za-z])[^>]*?/Count\s+(\d+)|/Count\s+(\d+)[^>]*?/Type\s*/Pages(?![A-Za-z])')
+
+
+class DocumentError(Exception):
+    pass
+
+
+def count_pages(path):
+    """Return the number of pages of the PDF at `path`, or None if it can't be told."""
+    with open(path, 'rb') as f:
+        content = f.read()
+    pages = len(_PAGE_OBJECT.findall(content))
+    if pages:
+        return pages
+    counts = [int(a or b) for a, b in _PAGE_TREE_COUNT.findall(content)]
+    return max(counts) if counts else None
+
+
+class DocumentStore:
+    """Files stored by the SHA-256 of their content, plus the partial downloads of URLs."""
+
+    def __init__(self, directory=DEFAULT_STORE_DIR):
+        self.directory = directory
+        self._partial_dir = os.path.join(directory, 'partial')
+        os.makedirs(self._partial_dir, exist_ok=True)
+
+    def path(self, sha256):
+        return os.path.join(self.directory, sha256[:2], f'{sha256}.pdf')
+
+    def _partial_path(self, url):
+        return os.path.join(self._partial_dir, hashlib.sha256(url.encode()).hexdigest() + '.part')
+
+    @staticmethod
+    def _validator(res):
+        """The value for If-Range that identifies this version of the file, or None.
+        A weak ETag can't be used there."""
+        etag = res.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return res.headers.get('Last-Modified')
+
+    def _download(self, url, partial, session, timeout, resume):
+        """Download `url` into `partial`, resuming it if `resume` and the server still has the
+        version it was started with. Returns False if the server answered with another range,
+        or another version, than the one asked for, leaving `partial` as it was."""
+        validator_path = f'{partial}.validator'
+        offset = 0
+        headers = {}
+        validator = None
+        if resume and os.path.exists(partial) and os.path.exists(validator_path):
+            with open(validator_path) as f:
+                validator = f.read()
+            offset = os.path.getsize(partial)
+            if offset:
+                headers = {'Range': f'bytes={offset}-', 'If-Range': validator}
+        run = metrics.current()
+        with session.get(url, headers=headers, timeout=timeout, stream=True) as res:
+            run.record_response(res, size=0)
+            if res.status_code == 416 and offset:
+                # The partial file is complete only if it is as long as the server's file; one
+                # that ignores If-Range answers so for a shorter replacement too
+                match = _CONTENT_RANGE_UNSATISFIED.match(res.headers.get('Content-Range', ''))
+                return bool(match) and int(match.group(1)) == offset \
+                    and self._validator(res) in (None, validator)
+            if res.status_code == 206:
+                # Also checked here, as some servers ignore If-Range
+                match = _CONTENT_RANGE_START.match(res.headers.get('Content-Range', ''))
+                if not match or int(match.group(1)) != offset or self._validator(res) not in (None, validator):
+                    return False
+                mode = 'ab'
+                logger.debug(f'{url}: resuming at byte {offset}')
+            elif res.status_code == 200:
+                # Not resumable, or the file changed since the partial download: start over
+                mode = 'wb'
+                validator = self._validator(res)
+                if validator:
+                    with open(validator_path, 'w') as f:
+                        f.write(validator)
+                elif os.path.exists(validator_path):
+                    os.remove(validator_path)
+            else:
+                raise DocumentError(f'got {res.status_code}')
+            with open(partial, mode) as f:
+                for chunk in res.iter_content(STREAM_CHUNK_SIZE):
+                    f.write(chunk)
+                    run.incr('http_bytes', len(chunk))
+        return True
+
+    def fetch(self, url, session, timeout=DEFAULT_TIMEOUT):
+        """Download `url` into the store, resuming an earlier partial download of it.
+        Returns (sha256, size) of the stored file."""
+        partial = self._partial_path(url)
+        if not self._download(url, partial, session, timeout, resume=True):
+            logger.warning(f'{url}: the server sent another range or version than asked for, downloading it again')
+            if not self._download(url, partial, session, timeout, resume=False):
+                raise DocumentError('the server sent a partial file when asked for the whole one')
+
+        digest = hashlib.sha256()
+        with open(partial, 'rb') as f:
+            for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        size = os.path.getsize(partial)
+        if os.path.exists(f'{partial}.validator'):
+            os.remove(f'{partial}.validator')
+        if not size:
+            os.remove(partial)
+            raise DocumentError('empty response')
+        path = self.path(sha256)
+        if os.path.exists(path):
+            os.remove(partial)  # the same file under another URL
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(partial, path)
+        return sha256, size
+
+
+def local_path(db, file_name, store_dir=DEFAULT_STORE_DIR):
+    """Return the path of the stored copy of the booklet file `file_name`, or None."""
+    row = db.get_document_file(file_name)
+    if row is None or row['sha256'] is None:
+        return None
+    return DocumentStore(store_dir).path(row['sha256'])
+
+
+def _fetch_one(store, document, session, timeout):
+    sha256, size = store.fetch(document['file_name'], session, timeout)
+    return sha256, size, count_pages(store.path(sha256))
+
+
+def fetch_documents(db, store=None, file_names=None, limit=None, workers=DEFAULT_WORKERS,
+                    session=None, timeout=DEFAULT_TIMEOUT):
+    """Download the booklet files not stored yet (only `file_names`, if given) and record
+    them in the DB. Returns the number of files stored."""
+    store = store or DocumentStore()
+    documents = db.get_documents_to_fetch(file_names=file_names, limit=limit)
+    if not documents:
+        return 0
+    logger.info(f'Fetching {len(documents)} document(s)')
+    run = metrics.current()
+    stored = 0
+    # A session made here is closed afterwards; a caller's is left open
+    with nullcontext(session) if session is not None else make_session(workers) as session, \
+            run.stage('documents'), concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        futures = {
+            executor.submit(_fetch_one, store, document, session, timeout): document
+            for document in documents
+        }
+        # Downloads run in the pool; the DB is only written from this thread
+        for future in concurrent.futures.as_completed(futures):
+            document = futures[future]
+            file_name = document['file_name']
+            try:
+                sha256, size, pages = future.result()
+            except (requests.RequestException, OSError, DocumentError) as e:
+                logger.error(f'{file_name}: download failed ({e})')
+                db.record_document(file_name, error=str(e))
+                run.incr('documents_failed')
+                continue
+            expected = document['number_of_pages']
+            if pages is None:
+                logger.info(f'{file_name}: could not count the pages of {sha256[:12]}')
+            elif expected and pages != expected:
+                logger.warning(f'{file_name}: has {pages} page(s), the API says {expected}')
+                run.incr('documents_page_mismatch')
+            db.record_document(file_name, sha256=sha256, size=size, page_count=pages)
+            stored += 1
+    run.incr('documents_stored', stored)
+    return stored
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--limit', type=int,
+        help='Fetch at most this many documents, newest booklets first (default: all)'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=DEFAULT_WORKERS,
+        help=f'Number of concurrent downloads (default: {DEFAULT_WORKERS})'
+    )
+    parser.add_argument(
+        '--store-dir', default=DEFAULT_STORE_DIR,
+        help=f'Directory of the document store (default: {DEFAULT_STORE_DIR})'
+    )
+    parser.add_argument(
+        '--timeout', type=float, default=DEFAULT_TIMEOUT,
+        help=f'Seconds to wait for the server to connect or send data (default: {DEFAULT_TIMEOUT})'
+    )
+    parser.add_argument(
+        '--metrics-textfile', metavar='PATH',
+        help='Also write the run metrics to this file in the Prometheus textfile format'
+    )
+    parser.add_argument('--log', default='info')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log.upper()))
+
+    with database.Database() as db, metrics.record_run('documents', db=db, textfile=args.metrics_textfile):
+        stored = fetch_documents(db, DocumentStore(args.store_dir), limit=args.limit,
+                                 workers=args.workers, timeout=args.timeout)
+        logger.info(f'done: {stored} document(s) stored')
+
+
+if __name__ == '__main__':
+    main()
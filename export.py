@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Export the booklet table, with the name of each booklet's type, to JSONL, CSV
+or Parquet.
+
+Rows are streamed from a cursor straight into the output file, so memory stays
+flat however large the DB is. Every export target (named with --target, by
+default after the output file) keeps a watermark in the DB: the change_seq of
+the last row it exported. The next export of that target only writes the rows
+inserted or changed since, e.g. a row whose jira_key was found in the meantime;
+--full ignores the watermark. The watermark only moves once the file is
+completely written.
+
+Parquet needs pyarrow, which is not installed by default:
+    pip install pyarrow
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import database
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ['jsonl', 'csv', 'parquet']
+DEFAULT_BATCH_SIZE = 1000  # rows per cursor fetch, and per Parquet row group
+COLUMNS = ['id', 'booklet_type', 'booklet_number', 'display_name', 'file_name', 'extension',
+           'number_of_pages', 'description', 'booklet_creation_date', 'modify_date',
+           'published_date', 'foreign_year', 'jira_key', 'change_seq']
+
+
+def _export_row(row):
+    row = dict(row, booklet_type=row['booklet_type_name'])
+    return {column: row[column] for column in COLUMNS}
+
+
+def write_jsonl(rows, f, batch_size=DEFAULT_BATCH_SIZE):
+    for row in rows:
+        f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def write_csv(rows, f, batch_size=DEFAULT_BATCH_SIZE):
+    writer = csv.DictWriter(f, fieldnames=COLUMNS)
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def write_parquet(rows, f, batch_size=DEFAULT_BATCH_SIZE):
+    schema = pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('booklet_type', pyarrow.string()),
+        ('booklet_number', pyarrow.int64()),
+        ('display_name', pyarrow.string()),
+        ('file_name', pyarrow.string()),
+        ('extension', pyarrow.string()),
+        ('number_of_pages', pyarrow.int64()),
+        ('description', pyarrow.string()),
+        ('booklet_creation_date', pyarrow.string()),
+        ('modify_date', pyarrow.string()),
+        ('published_date', pyarrow.string()),
+        ('foreign_year', pyarrow.int64()),
+        ('jira_key', pyarrow.string()),
+        ('change_seq', pyarrow.int64()),
+    ])
+    with pyarrow.parquet.ParquetWriter(f, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+                batch = []
+        # Also written when empty, so the file always has the schema
+        writer.write_table(pyarrow.Table.from_pylist(batch, schema=schema))
+
+
+WRITERS = {'jsonl': write_jsonl, 'csv': write_csv, 'parquet': write_parquet}
+
+
+def watermark_name(target):
+    return f'export_watermark:{target}'
+
+
+def export(db, path, fmt, target, full=False, batch_size=DEFAULT_BATCH_SIZE):
+    """Write the rows of `target` changed since its watermark (all of them with `full`) to
+    `path`, or to stdout for `-`, and move the watermark. Returns the number of rows written."""
+    after_seq = 0 if full else int(db.get_meta(watermark_name(target), 0))
+    written = 0
+    last_seq = after_seq
+
+    def rows():
+        nonlocal written, last_seq
+        for row in db.iter_export_rows(after_seq, batch_size):
+            written += 1
+            last_seq = row['change_seq']
+            yield _export_row(row)
+
+    binary = fmt == 'parquet'
+    with metrics.current().stage('export'):
+        if path == '-':
+            WRITERS[fmt](rows(), sys.stdout.buffer if binary else sys.stdout, batch_size)
+        else:
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'wb') if binary else open(tmp_path, 'w', encoding='utf8', newline='') as f:
+                WRITERS[fmt](rows(), f, batch_size)
+            os.replace(tmp_path, path)
+    metrics.current().incr('rows_exported', written)
+    db.set_meta(watermark_name(target), str(last_seq))
+    logger.info(f'{target}: exported {written} row(s) changed after #{after_seq}, up to #{last_seq}')
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output', help='The file to write, or - for stdout')
+    parser.add_argument(
+        '--format', choices=FORMATS,
+        help='Output format (default: from the output file extension, or jsonl)'
+    )
+    parser.add_argument(
+        '--target',
+        help='Name under which the watermark of this export is kept (default: the output file name)'
+    )
+    parser.add_argument(
+        '--full', action='store_true',
+        help='Export every row, not only those changed since the last export of this target'
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+        help=f'Rows per cursor fetch and per Parquet row group (default: {DEFAULT_BATCH_SIZE})'
+    )
+    parser.add_argument('--log', default='info')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log.upper()))
+
+    fmt = args.format or os.path.splitext(args.output)[1].lstrip('.').lower()
+    if fmt not in FORMATS:
+        fmt = 'jsonl'
+    if fmt == 'parquet' and pyarrow is None:
+        parser.error('Parquet export needs pyarrow: pip install pyarrow')
+    target = args.target or (os.path.basename(args.output) if args.output != '-' else 'stdout')
+
+    with database.Database() as db, metrics.record_run('export', db=db):
+        export(db, args.output, fmt, target, full=args.full, batch_size=args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
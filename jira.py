@@ -1,17 +1,94 @@
 import base64
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import logging
 import os
+import random
+import threading
 import time
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+import metrics
 
 
 logger = logging.getLogger(__name__)
 
+BULK_BATCH_SIZE = 50  # the most issues Jira accepts in one bulk-create request
+FILE_NAME_CHUNK_SIZE = 50  # file names per `cf[11689] in (...)` query
+SEARCH_PAGE_SIZE = 100
+MIRROR_SYNC_OVERLAP = timedelta(days=1)  # covers the gap between UTC and the JQL user's time zone
+MIRROR_FIELDS = ['summary', 'customfield_11689', 'customfield_11690']
+DEFAULT_BASE_URL = 'https://kolzchut.atlassian.net'
+DEFAULT_WORKERS = 4
+DEFAULT_RATE = 5.0  # requests per second, before adapting to 429s
+DEFAULT_TIMEOUT = 30  # seconds
+DEFAULT_MAX_RETRIES = 5
+
+
+class RateLimiter:
+    """Token bucket shared by all the workers of a JiraApi.
+
+    The rate adapts to what Jira grants: it is halved on every 429 and creeps
+    back up by a tenth of the initial rate on every success. A 429's
+    Retry-After pauses *all* workers, not just the one that got it."""
+
+    def __init__(self, rate=DEFAULT_RATE, burst=None):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be made."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self, retry_after):
+        """Record a 429: stop everyone for `retry_after` seconds and slow down."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            self.tokens = 0
+            self.rate = max(self.max_rate / 20, self.rate / 2)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
 
 class JiraApi:
-    def __init__(self):
-        self.url = 'https://kolzchut.atlassian.net/rest/api/2/issue/'
+    def __init__(self, workers=DEFAULT_WORKERS, rate=DEFAULT_RATE, timeout=DEFAULT_TIMEOUT,
+                 max_retries=DEFAULT_MAX_RETRIES, mirror=None, base_url=None):
+        """`mirror`, a database.Database, makes the search methods look in the local
+        jira_issue mirror first and only query Jira for what it can't resolve.
+        `base_url` defaults to $JIRA_BASE_URL, or the Kol Zchut Jira Cloud site."""
+        self.base_url = base_url or os.environ.get('JIRA_BASE_URL', DEFAULT_BASE_URL)
+        self.url = f'{self.base_url}/rest/api/2/issue/'
+        self.mirror = mirror
+        self.workers = workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.limiter = RateLimiter(rate)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.user_name = os.environ['JIRA_API_USER']
         api_token = os.environ['JIRA_API_TOKEN']
         token = f'{self.user_name}:{api_token}'
@@ -21,45 +98,258 @@ class JiraApi:
             'authorization': f'Basic {token}',
         }
 
-    def send(self, data, dry_run=False):
-        """Send items to Jira. Returns list of (datum, jira_key) for each successfully created issue."""
-        results = []
-        for datum in data:
-            summary = datum['display_name'] if len(datum['display_name']) < 255 else f"{datum['display_name'][:250]}..."
-            payload = {
-                'fields': {
-                    'project': {
-                        'key': 'KOL',
-                    },
-                    'summary': summary,
-                    'description': datum['description'],
-                    'issuetype': {
-                        'name': 'שינוי חקיקה (עברית)',
-                    },
-                    'reporter': self.user_name,
-                    'customfield_11690': datum['published_date'],
-                    'customfield_11689': datum['file_name'],
-                    'customfield_11703': datum['display_name'],
-                }
+    @staticmethod
+    def _backoff(attempt):
+        """Seconds to wait before retry number `attempt`: jittered and exponential."""
+        return min(60, 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    @staticmethod
+    def _not_sent(error):
+        """Whether a failed request never reached Jira: the connection couldn't be made."""
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(error, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+    def _request(self, method, url, create=False, **kwargs):
+        """Make a rate-limited request, retrying on 429 (after Retry-After), on 5xx and on
+        connection errors (with jittered exponential backoff). Returns the last response.
+
+        Jira may have carried out a `create` request whose response was lost or was a 5xx,
+        so those are only retried on 429, on a 503 with Retry-After, and when the connection
+        couldn't be made; otherwise the error is raised, or the response returned, at once."""
+        for attempt in range(self.max_retries + 1):
+            backoff = self._backoff(attempt)
+            self.limiter.acquire()
+            if attempt:
+                metrics.current().incr('retries')
+            try:
+                res = self.session.request(method, url, headers=self.headers, timeout=self.timeout, **kwargs)
+            except requests.RequestException as e:
+                if attempt == self.max_retries or (create and not self._not_sent(e)):
+                    raise
+                logger.warning(f'Jira request failed ({e}), retrying in {backoff:.1f}s...')
+                time.sleep(backoff)
+                continue
+            metrics.current().record_response(res)
+            if attempt == self.max_retries:
+                return res
+            if res.status_code == 429:
+                try:
+                    wait = float(res.headers.get('Retry-After', 10))
+                except ValueError:
+                    wait = 10
+                logger.warning(f'Rate limited by Jira, waiting {wait}s...')
+                self.limiter.throttled(wait)
+                continue
+            if res.status_code >= 500:
+                if create:
+                    if res.status_code != 503 or 'Retry-After' not in res.headers:
+                        return res
+                    try:
+                        backoff = float(res.headers['Retry-After'])
+                    except ValueError:
+                        pass
+                logger.warning(f'Jira returned {res.status_code}, retrying in {backoff:.1f}s...')
+                time.sleep(backoff)
+                continue
+            self.limiter.succeeded()
+            return res
+
+    def _map(self, fn, items):
+        """Apply fn to every item on the worker pool, returning the results in order."""
+        items = list(items)
+        if self.workers <= 1 or len(items) <= 1:
+            return [fn(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(fn, items))
+
+    @staticmethod
+    def _summary(display_name):
+        """The issue summary for a display_name, truncated to fit Jira's 255-character limit."""
+        return display_name if len(display_name) < 255 else f"{display_name[:250]}..."
+
+    def _build_payload(self, datum):
+        """Return the (summary, create-issue payload) for a cleaned DB item."""
+        summary = self._summary(datum['display_name'])
+        payload = {
+            'fields': {
+                'project': {
+                    'key': 'KOL',
+                },
+                'summary': summary,
+                'description': datum['description'],
+                'issuetype': {
+                    'name': 'שינוי חקיקה (עברית)',
+                },
+                'reporter': self.user_name,
+                'customfield_11690': datum['published_date'],
+                'customfield_11689': datum['file_name'],
+                'customfield_11703': datum['display_name'],
             }
+        }
+        return summary, payload
+
+    def _post_create(self, url, payload):
+        """POST an issue creation. Returns the response, or None when it can't be told
+        whether Jira created anything: the response was lost, or was a 5xx."""
+        try:
+            res = self._request('POST', url, create=True, json=payload)
+        except requests.RequestException as e:
+            logger.warning(f'  create request failed ({e})')
+            return None
+        if res.status_code >= 500:
+            logger.warning(f'  create request failed – status {res.status_code}: {res.content}')
+            return None
+        return res
+
+    def _find_created(self, items):
+        """Look up the issues of items by file name, matched like find_keys does, but always
+        in Jira itself, where issues just created are. Returns the key of each item (None
+        if it has no issue), or None if a search failed."""
+        file_names = sorted({item['file_name'] for item in items})
+        chunks = [file_names[start:start + FILE_NAME_CHUNK_SIZE]
+                  for start in range(0, len(file_names), FILE_NAME_CHUNK_SIZE)]
+        issues_by_file_name = {}
+        for chunk in chunks:
+            issues = self._search_file_names(chunk)
+            if issues is None:
+                return None
+            issues_by_file_name.update(issues)
+        return [self._pick_issue(issues_by_file_name.get(item['file_name'], []),
+                                 item['display_name'], item.get('published_date'))
+                for item in items]
+
+    def _create_reconciled(self, items, create):
+        """Create the issues of `items` with `create(items)`, which returns the key of each
+        item (None if Jira refused it), or None when it can't be told whether Jira created
+        them. Then, rather than posting them again and maybe duplicating them, the issues
+        are looked up first, and only the items still without one are sent again.
+        Returns the key of each item, or None."""
+        keys = [None] * len(items)
+        pending = list(range(len(items)))
+        for attempt in range(self.max_retries + 1):
+            created = create([items[i] for i in pending])
+            if created is not None:
+                for i, jira_key in zip(pending, created):
+                    keys[i] = jira_key
+                return keys
+            # Also gives Jira's search index time to catch up with what it did create
+            time.sleep(self._backoff(attempt + 1))
+            found = self._find_created([items[i] for i in pending])
+            if found is None:
+                logger.error(f'  could not check whether {len(pending)} issue(s) were created; '
+                             f'not sending them again')
+                return keys
+            for i, jira_key in zip(pending, found):
+                if jira_key:
+                    logger.info(f'  #{items[i].get("booklet_number", "?")} → {jira_key} (created before the error)')
+                    keys[i] = jira_key
+            pending = [i for i, jira_key in zip(pending, found) if not jira_key]
+            if not pending:
+                return keys
+            if attempt < self.max_retries:
+                logger.warning(f'  {len(pending)} issue(s) were not created, sending them again')
+                metrics.current().incr('retries')
+        return keys
+
+    def _create_issues(self, batch):
+        """Create a batch of issues with one bulk request. Returns the key of each item, or None."""
+        return self._create_reconciled(batch, self._post_issues)
+
+    def _post_issues(self, batch):
+        payloads = []
+        for datum in batch:
+            summary, payload = self._build_payload(datum)
+            logger.info(f'  sending #{datum.get("booklet_number", "?")}: {summary[:80]}')
+            logger.debug(f'  full payload for #{datum.get("booklet_number", "?")}: {payload}')
+            payloads.append(payload)
+        res = self._post_create(f'{self.url}bulk', {'issueUpdates': payloads})
+        if res is None:
+            return None
+        try:
+            body = res.json()
+        except ValueError:
+            body = {}
+        errors = body.get('errors') or []
+        if res.status_code >= 300 and not errors:
+            # The request as a whole was rejected (auth, bad request...): nothing was created
+            logger.error(f'  bulk request for {len(batch)} item(s) failed – status {res.status_code}: '
+                         f'{res.content}')
+            errors = [{'failedElementNumber': i, 'status': res.status_code} for i in range(len(batch))]
+
+        failed = {}
+        for error in errors:
+            failed[error['failedElementNumber']] = error
+        # Jira lists the created issues in request order, skipping the failed elements
+        created = iter(body.get('issues') or [])
+        keys = []
+        for index, datum in enumerate(batch):
             booklet_num = datum.get('booklet_number', '?')
-            logger.info(f'  sending #{booklet_num}: {summary[:80]}')
-            logger.debug(f'  full payload for #{booklet_num}: {payload}')
-            if dry_run:
-                print(f'[DRY RUN] Jira issue payload:\n{payload}')
+            if index in failed:
+                error = failed[index]
+                logger.error(f'  #{booklet_num} failed – status {error.get("status")}: '
+                             f'{error.get("elementErrors", "")}')
+                logger.error(f'  file: {datum["file_name"]}')
+                keys.append(None)
                 continue
-            res = requests.post(self.url, headers=self.headers, json=payload)
+            issue = next(created, None)
+            if issue is None:
+                logger.error(f'  #{booklet_num}: no issue returned by Jira')
+                keys.append(None)
+                continue
+            logger.info(f'  #{booklet_num} → {issue["key"]}')
+            keys.append(issue['key'])
+        return keys
 
-            if res.status_code >= 300:
-                logger.error(f'  #{booklet_num} failed – status {res.status_code}: {res.content}')
-                logger.error(f'  file: {datum["file_name"]}')
-                break
-            else:
-                jira_key = res.json().get('key')
-                logger.info(f'  #{booklet_num} → {jira_key}')
-                results.append((datum, jira_key))
+    def send_bulk(self, data, dry_run=False, batch_size=BULK_BATCH_SIZE):
+        """Send items to Jira through the bulk-create endpoint, `batch_size` issues per request,
+        with the batches spread over the worker pool.
+        Unlike a single failed request, a failed item doesn't affect the rest: each failure is
+        logged with its booklet and file, and the other items of its batch are still created.
+        Returns list of (datum, jira_key) for each successfully created issue."""
+        data = list(data)
+        batches = [data[start:start + batch_size] for start in range(0, len(data), batch_size)]
+        if dry_run:
+            for batch in batches:
+                payloads = [self._build_payload(datum)[1] for datum in batch]
+                print(f'[DRY RUN] Jira bulk payload ({len(payloads)} issue(s)):\n{payloads}')
+            return []
+        results = []
+        for batch, keys in zip(batches, self._map(self._create_issues, batches)):
+            results.extend((datum, jira_key) for datum, jira_key in zip(batch, keys) if jira_key)
         return results
 
+    def _update_issue(self, datum):
+        """Overwrite the fields of an existing issue that come from the booklet's content.
+        Returns the status code of Jira's last response."""
+        _, payload = self._build_payload(datum)
+        fields = {name: payload['fields'][name]
+                  for name in ('description', 'customfield_11690', 'customfield_11689')}
+        res = self._request('PUT', f'{self.url}{datum["jira_key"]}', json={'fields': fields})
+        booklet_num = datum.get('booklet_number', '?')
+        if res.status_code >= 300:
+            logger.error(f'  updating {datum["jira_key"]} for #{booklet_num} failed – '
+                         f'status {res.status_code}: {res.content}')
+        else:
+            logger.info(f'  #{booklet_num} → {datum["jira_key"]} updated')
+        return res.status_code
+
+    def update(self, data, dry_run=False):
+        """Update the issues of changed items, which carry their `jira_key`, on the worker pool.
+        Returns (updated, refused): the items whose issue was updated, and those whose update
+        Jira refused for good, with a 4xx other than 429 (e.g. the issue was deleted, or a
+        field doesn't validate), so retrying it would not help."""
+        data = list(data)
+        if dry_run:
+            for datum in data:
+                print(f'[DRY RUN] would update {datum["jira_key"]} for #{datum["booklet_number"]}')
+            return [], []
+        statuses = self._map(self._update_issue, data)
+        updated = [datum for datum, status in zip(data, statuses) if status < 300]
+        refused = [datum for datum, status in zip(data, statuses) if 400 <= status < 500 and status != 429]
+        return updated, refused
+
     @staticmethod
     def _jql_escape(value):
         """Escape a value for use inside a JQL double-quoted string."""
@@ -76,31 +366,89 @@ class JiraApi:
         return re.sub(r'\s+', ' ', value).strip()
 
     def _search_jql(self, jql, fields, max_results=50):
-        """Execute a JQL search, handling rate limiting. Returns list of issues or None on error."""
+        """Execute a JQL search through _request. Returns list of issues or None on error."""
         params = {'jql': jql, 'maxResults': max_results, 'fields': fields}
-        res = requests.get(
-            'https://kolzchut.atlassian.net/rest/api/3/search/jql',
-            headers=self.headers,
-            params=params,
-        )
-        while res.status_code == 429:
-            wait = int(res.headers.get('Retry-After', 10))
-            logger.warning(f'Rate limited by Jira, waiting {wait}s...')
-            time.sleep(wait)
-            res = requests.get(
-                'https://kolzchut.atlassian.net/rest/api/3/search/jql',
-                headers=self.headers,
-                params=params,
-            )
+        res = self._request('GET', f'{self.base_url}/rest/api/3/search/jql', params=params)
         if res.status_code != 200:
             logger.error(f'Jira search failed: {res.status_code} {res.content}')
             return None
         return res.json().get('issues', [])
 
+    def _search_jql_all(self, jql, fields):
+        """Execute a JQL search and follow nextPageToken through every page of results.
+        `fields` is a list of field names. Returns list of issues or None on error."""
+        issues = []
+        body = {'jql': jql, 'fields': fields, 'maxResults': SEARCH_PAGE_SIZE}
+        while True:
+            res = self._request('POST', f'{self.base_url}/rest/api/3/search/jql', json=body)
+            if res.status_code != 200:
+                logger.error(f'Jira search failed: {res.status_code} {res.content}')
+                return None
+            page = res.json()
+            issues.extend(page.get('issues', []))
+            if page.get('isLast', True) or not page.get('nextPageToken'):
+                return issues
+            body['nextPageToken'] = page['nextPageToken']
+
+    def _search_file_names(self, file_names):
+        """Fetch every KOL issue whose cf[11689] is one of file_names, grouped by file name."""
+        values = ', '.join(f'"{self._jql_escape(file_name)}"' for file_name in file_names)
+        jql = f'project = KOL AND cf[11689] in ({values})'
+        issues = self._search_jql_all(jql, MIRROR_FIELDS)
+        if issues is None:
+            return None
+        by_file_name = {}
+        for issue in issues:
+            by_file_name.setdefault(issue['fields'].get('customfield_11689'), []).append(issue)
+        return by_file_name
+
+    def find_keys(self, items, chunk_size=FILE_NAME_CHUNK_SIZE):
+        """Resolve the Jira keys of many DB rows with a few searches.
+
+        Issues are fetched by file URL, `chunk_size` distinct file names per query on
+        the worker pool, then matched to rows locally: an omnibus booklet has one file
+        but an issue per display_name, so the summary match and published_date
+        tie-breaking of search_by_display_name apply.
+        Returns list of (item, jira_key or None), in the order of `items`."""
+        items = list(items)
+        if self.mirror is not None:
+            local = [(item, self._pick_issue(self._mirrored_by_summary(item['display_name']),
+                                             item['display_name'], item.get('published_date')))
+                     for item in items]
+            unresolved = [item for item, jira_key in local if not jira_key]
+            logger.debug(f'mirror resolved {len(items) - len(unresolved)} of {len(items)} row(s)')
+            live = iter(self._find_keys_live(unresolved, chunk_size))
+            return [(item, jira_key) if jira_key else next(live) for item, jira_key in local]
+        return self._find_keys_live(items, chunk_size)
+
+    def _find_keys_live(self, items, chunk_size):
+        if not items:
+            return []
+        file_names = sorted({item['file_name'] for item in items if item.get('file_name')})
+        chunks = [file_names[start:start + chunk_size] for start in range(0, len(file_names), chunk_size)]
+        issues_by_file_name = {}
+        for issues in self._map(self._search_file_names, chunks):
+            if issues is not None:
+                issues_by_file_name.update(issues)
+        logger.debug(f'{len(chunks)} search(es) found issues for '
+                     f'{len(issues_by_file_name)} of {len(file_names)} file(s)')
+        return [
+            (item, self._pick_issue(issues_by_file_name.get(item.get('file_name'), []),
+                                    item['display_name'], item.get('published_date')))
+            for item in items
+        ]
+
     def search_by_file_name(self, file_name):
         """Search Jira for an issue by file URL (customfield_11689).
         Uses exact JQL match on cf[11689], which is unique per issue.
         Returns the issue key string, or None if not found."""
+        if self.mirror is not None:
+            keys = [issue['key'] for issue in self.mirror.get_jira_issues_by_file_name(file_name)]
+            if len(keys) == 1:
+                return keys[0]
+            if len(keys) > 1:
+                logger.warning(f'Multiple Jira issues match file_name {file_name!r}: {keys}')
+                return None
         jql = f'project = KOL AND cf[11689] = "{self._jql_escape(file_name)}"'
         issues = self._search_jql(jql, fields='summary', max_results=2)
         if issues is None:
@@ -119,6 +467,10 @@ class JiraApi:
         If multiple summaries match and published_date is given, uses
         customfield_11690 to disambiguate.
         Returns the issue key string, or None if not found (or multiple found)."""
+        if self.mirror is not None:
+            jira_key = self._pick_issue(self._mirrored_by_summary(display_name), display_name, published_date)
+            if jira_key:
+                return jira_key
         # Use the text before any tab as the search term (page numbers after \t are noise)
         search_term = display_name.split('\t')[0].strip()
         # Hebrew year notation (e.g. התשפ"ו) uses ASCII " which breaks JQL ~ queries;
@@ -128,12 +480,15 @@ class JiraApi:
             search_term = search_term.split('"')[0].strip().rstrip(',').strip()
         jql = f'project = KOL AND summary ~ "{self._jql_escape(search_term)}"'
         issues = self._search_jql(jql, fields='summary,customfield_11690')
-        if issues is None:
-            return None
         if not issues:
             return None
-        # Post-filter: normalize whitespace and compare to our expected summary
-        target = self._normalize_summary(display_name)
+        return self._pick_issue(issues, display_name, published_date)
+
+    def _pick_issue(self, issues, display_name, published_date=None):
+        """Return the key of the one issue among `issues` whose summary matches display_name,
+        using customfield_11690 == published_date to break ties. None if no single match."""
+        # Post-filter: normalize whitespace and compare to the summary we would have sent
+        target = self._normalize_summary(self._summary(display_name))
         matches = [i for i in issues if self._normalize_summary(i['fields']['summary']) == target]
         if len(matches) == 1:
             return matches[0]['key']
@@ -151,3 +506,52 @@ class JiraApi:
             logger.warning(f'Multiple Jira issues match {display_name!r}: {keys}')
             return None
         return None
+
+    def search_many(self, items):
+        """Run search_by_display_name for many DB rows on the worker pool.
+        Returns list of (item, jira_key or None), in the order of `items`."""
+        items = list(items)
+        keys = self._map(
+            lambda item: self.search_by_display_name(item['display_name'], published_date=item.get('published_date')),
+            items,
+        )
+        return list(zip(items, keys))
+
+    def _mirrored_by_summary(self, display_name):
+        """Mirrored issues whose summary matches display_name, shaped like search results."""
+        target = self._normalize_summary(self._summary(display_name))
+        return [
+            {'key': row['key'], 'fields': {'summary': row['summary'],
+                                           'customfield_11689': row['file_name'],
+                                           'customfield_11690': row['published_date']}}
+            for row in self.mirror.get_jira_issues_by_summary(target)
+        ]
+
+    def sync_mirror(self, db, full=False):
+        """Bring the jira_issue table of `db` up to date with the KOL project.
+        The first sync (or a `full` one) pulls every issue; later ones only pull issues
+        updated since the previous sync. Returns the number of issues stored, or None
+        if the search failed, in which case the watermark is left untouched."""
+        since = None if full else db.get_meta('jira_mirror_synced_at')
+        started = datetime.now(timezone.utc)
+        jql = 'project = KOL'
+        if since:
+            jql += f' AND updated >= "{since}"'
+        logger.info(f'syncing Jira mirror ({"since " + since if since else "full"})')
+        issues = self._search_jql_all(f'{jql} ORDER BY key', MIRROR_FIELDS)
+        if issues is None:
+            return None
+        db.upsert_jira_issues([
+            {
+                'key': issue['key'],
+                'summary': issue['fields'].get('summary'),
+                'normalized_summary': self._normalize_summary(issue['fields'].get('summary') or ''),
+                'file_name': issue['fields'].get('customfield_11689'),
+                'published_date': issue['fields'].get('customfield_11690'),
+            }
+            for issue in issues
+        ])
+        db.set_meta('jira_mirror_synced_at', (started - MIRROR_SYNC_OVERLAP).strftime('%Y/%m/%d %H:%M'))
+        logger.info(f'Jira mirror: {len(issues)} issue(s) stored, {db.count_jira_issues()} in total')
+        return len(issues)
+
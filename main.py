@@ -1,11 +1,24 @@
 #!/usr/bin/env python
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import functools
+import json
 import logging
 
-from cleaner import clean_data
+import requests
+
+import archive
+import documents
+import metrics
+import outbox
+import watch
+from cache import DEFAULT_CACHE_DIR, ResponseCache
+from cleaner import clean_data, clean_records, iter_unique
 import database
-from scraper import get_html
+from scraper import (DEFAULT_PAGE_SIZE, DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT, FOLDER_TYPES, high_water_mark,
+                     iter_pages, make_session, stream_results)
 from jira import JiraApi
 
 
@@ -13,58 +26,565 @@ logger = logging.getLogger(__name__)
 
 DEFAULT_FETCH_LIMIT = 500
 DEFAULT_LOOKBACK = 50
+STREAM_INSERT_BATCH = 500
+HIGH_WATER_META = 'high_water'  # meta row holding the marks probe_changes() compares with
+HELD_UPDATES_META = 'held_updates'  # meta row holding the changed items waiting for their issue update
 
 
-def should_insert_booklet(last_booklet, booklet, existing_entries: set, lookback: int):
+def lookback_threshold(last_booklet, lookback):
     """
-    Return True if this booklet should be inserted into the DB.
+    Return the lowest booklet number still worth inserting, or None for no limit.
 
-    Rules:
-    - Skip if already in the DB (prevents duplicates). Uniqueness is determined
-      by (booklet_number, display_name) so that different laws within the same
-      booklet are each treated as distinct entries.
+    Rules (entries already in the DB are never inserted again; uniqueness is
+    determined by (booklet_number, display_name) so that different laws within
+    the same booklet are each treated as distinct entries):
     - If no last_booklet exists, treat everything as new.
     - Otherwise accept anything within `lookback` items behind the last known
       number, so that gaps (items the API skipped on a previous run) are
       back-filled, as well as anything newer than the last known number.
     """
-    booklet_num = int(booklet['booklet_number'])
-    label = booklet.get('booklet_type', '?')
-
-    if (booklet_num, booklet['display_name']) in existing_entries:
-        logger.debug(f'  skip {label} #{booklet_num}: already in DB')
-        return False
-
     if not last_booklet:
-        logger.debug(f'  insert {label} #{booklet_num}: no anchor in DB')
-        return True
-
+        return None
     try:
         last_num = int(last_booklet['booklet_number'])
     except Exception:
         logger.warning(
             f"Unable to parse last_booklet['booklet_number']="
-            f"{last_booklet.get('booklet_number')} as int; treating as no last_booklet"
+            f"{last_booklet['booklet_number']} as int; treating as no last_booklet"
         )
-        return True
+        return None
+    return last_num - lookback
+
+
+def select_items(db, items, booklet_type, threshold):
+    """Sort cleaned items into (new, changed, unhashed) with Database.classify_items()."""
+    with metrics.current().stage('select'):
+        return db.classify_items(db.booklet_types[booklet_type], items, threshold)
+
+
+def stream_new(db, source, booklet_type, threshold, limit, args, session=None, make_jira_api=JiraApi):
+    """Fetch a window of `limit` records for `source` as a stream, and clean, select and
+    insert or update them as they arrive, STREAM_INSERT_BATCH at a time, so memory stays
+    flat however large the window is. Returns the newly inserted items, the changed ones
+    and the changed ones left as they were because Jira didn't take their update."""
+    records = _counted(stream_results(source, limit, session=session, timeout=args.timeout), 'rows_fetched')
+    items = iter_unique(_counted(clean_records(records, booklet_type), 'rows_cleaned'))
+    inserted = []
+    changed = []
+    held = []
+
+    def flush(batch):
+        new, batch_changed, unhashed = select_items(db, batch, booklet_type, threshold)
+        metrics.current().incr('rows_filtered', len(new))
+        inserted.extend(_insert_batch(db, new, args.dry_run))
+        stored, not_stored = _update_changed(db, batch_changed, unhashed, args, make_jira_api)
+        changed.extend(stored)
+        held.extend(not_stored)
+
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= STREAM_INSERT_BATCH:
+            flush(batch)
+            batch = []
+    flush(batch)
+    logger.info(f'{source}: {len(inserted)} new and {len(changed)} changed item(s) '
+                f'from a streamed window of {limit}')
+    return inserted, changed, held
+
+
+def _counted(items, counter):
+    """Pass `items` through, adding each to the run metrics' `counter` as it goes by."""
+    for item in items:
+        metrics.current().incr(counter)
+        yield item
+
+
+def _update_changed(db, changed, unhashed, args, make_jira_api=JiraApi):
+    """Update the issues of items whose content changed (with --update-jira), then overwrite
+    their stored rows, and record the hash of those stored before hashes were kept.
+
+    The row of an item whose issue update failed in a way that may pass (429, 5xx, or no
+    connection) keeps its old content and hash until a later run retries it; see
+    _retry_held_updates(). Returns (stored, held): the changed items stored, and those held."""
+    for item in changed:
+        logger.info(f'  {item["booklet_type"]} #{item["booklet_number"]} changed: {item["display_name"][:80]}')
+    if args.dry_run:
+        for item in changed:
+            print(f'[DRY RUN] would update {item["booklet_type"]}: '
+                  f'{item["booklet_number"]} – {item["display_name"]}')
+        update_in_jira(changed, args, make_jira_api)
+        return changed, []
+    failed = {item['id'] for item in update_in_jira(changed, args, make_jira_api)}
+    held = [item for item in changed if item['id'] in failed]
+    changed = [item for item in changed if item['id'] not in failed]
+    if changed or unhashed:
+        with metrics.current().stage('update'):
+            db.update_items(changed + unhashed)
+    metrics.current().incr('rows_changed', len(changed))
+    return changed, held
+
+
+def _insert_batch(db, batch, dry_run=False):
+    """Insert cleaned items, and queue them for Jira, in one transaction; return those that
+    weren't already stored."""
+    if not batch:
+        return []
+    if dry_run:
+        for item in batch:
+            print(f'[DRY RUN] would insert {item["booklet_type"]}: '
+                  f'{item["booklet_number"]} – {item["display_name"]}')
+        return batch
+    with metrics.current().stage('insert'):
+        for item, row_id in zip(batch, db.insert_items(batch, enqueue=True)):
+            item['id'] = row_id
+    # insert_items returns None, and queues nothing, when the DB already held the entry
+    inserted = [item for item in batch if item['id'] is not None]
+    metrics.current().incr('rows_inserted', len(inserted))
+    return inserted
+
+
+def send_to_jira(db, new_items, args, make_jira_api=JiraApi):
+    """Drain the Jira outbox, which holds the new items along with any earlier ones still
+    waiting for a retry, unless --no-drain leaves that to outbox.py."""
+    if args.dry_run:
+        if new_items:
+            print(f'[DRY RUN] would send {len(new_items)} item(s) to Jira')
+        return
+    if args.no_drain:
+        if new_items:
+            logger.info(f'{len(new_items)} item(s) queued for Jira; outbox.py will send them')
+        return
+    outbox.drain(db, make_jira_api)
+
+
+def update_in_jira(changed_items, args, make_jira_api=JiraApi):
+    """With --update-jira, bring the issues of changed items up to date. Changed items that
+    have no issue yet need nothing: the outbox sends each row as it is stored at the time.
+    Returns the items whose issue Jira didn't update, but might on a retry; those whose
+    update it refused for good are only logged and counted, to be stored regardless."""
+    to_update = [item for item in changed_items if item['jira_key']]
+    if not args.update_jira or not to_update:
+        return []
+    logger.info(f'Updating {len(to_update)} Jira issue(s) of changed item(s)')
+    with metrics.current().stage('jira_update'):
+        try:
+            updated, refused = make_jira_api().update(to_update, dry_run=args.dry_run)
+        except requests.RequestException as e:
+            logger.error(f'Jira unreachable ({e}), no issue updated')
+            updated, refused = [], []
+    if args.dry_run:
+        return []
+    done_ids = {item['id'] for item in updated + refused}
+    failed = [item for item in to_update if item['id'] not in done_ids]
+    metrics.current().incr('jira_issues_updated', len(updated))
+    if refused:
+        logger.error(f'Jira refused to update the issue of {len(refused)} changed item(s), stored anyway: '
+                     + ', '.join(item['jira_key'] for item in refused))
+        metrics.current().incr('jira_update_refused', len(refused))
+    if failed:
+        logger.warning(f'{len(failed)} changed item(s) kept as they were until their issue is updated')
+        metrics.current().incr('jira_update_failed', len(failed))
+    return failed
+
+
+def fetch_documents(db, items, args):
+    """With --fetch-documents, download the booklet files of new and changed items that are
+    not in the document store yet."""
+    if not args.fetch_documents or not items:
+        return
+    file_names = {item['file_name'] for item in items if item.get('file_name')}
+    if args.dry_run:
+        print(f'[DRY RUN] would fetch up to {len(file_names)} document(s)')
+        return
+    documents.fetch_documents(db, documents.DocumentStore(args.document_store), file_names=file_names,
+                              workers=args.document_workers, timeout=args.timeout)
+
+
+def fetch_new(db, source, booklet_type, threshold, page_size, session=None, timeout=DEFAULT_TIMEOUT,
+              cache=None, offline=False, max_records=DEFAULT_FETCH_LIMIT):
+    """Page through the API for `source`, at most `max_records` records, until a whole page
+    has nothing new or changed.
+
+    Each page is cleaned and sorted with select_items() as it arrives, which also decides
+    whether to fetch the next one, so nothing is classified twice. Returns (new, changed,
+    unhashed) over all the pages, as select_items() would for their merged records."""
+    run_metrics = metrics.current()
+    selected = []  # the (new, changed, unhashed) of every page, newest page first
+
+    def nothing_new(page):
+        new, changed, _ = selected[-1]
+        return not new and not changed
+
+    pages = iter_pages(source, page_size, max_records=max_records, stop=nothing_new,
+                       session=session, timeout=timeout, cache=cache, offline=offline)
+    while True:
+        # Timed apart from cleaning and selecting, so that the stages don't overlap
+        with run_metrics.stage('fetch'):
+            page = next(pages, None)
+        if page is None:
+            break
+        run_metrics.incr('rows_fetched', len(page.get('Results') or []))
+        with run_metrics.stage('clean_data'):
+            items = list(clean_data(page, booklet_type))
+        run_metrics.incr('rows_cleaned', len(items))
+        selected.append(select_items(db, items, booklet_type, threshold))
+    return _merge_selected(reversed(selected))
+
+
+def _merge_selected(selected):
+    """Merge the select_items() results of pages, given oldest page first, into one. An entry
+    more than one page holds is kept where it last occurs, as select_items() dedups a batch."""
+    merged = {}
+    for page in selected:
+        for kind, items in enumerate(page):
+            for item in items:
+                key = (item['booklet_number'], item['display_name'])
+                merged.pop(key, None)
+                merged[key] = (kind, item)
+    new, changed, unhashed = [], [], []
+    for kind, item in merged.values():
+        (new, changed, unhashed)[kind].append(item)
+    return new, changed, unhashed
+
+
+def _session_or_new(session, pool_size):
+    """Use a caller's warm session as-is, or a new one that is closed afterwards."""
+    return nullcontext(session) if session is not None else make_session(pool_size)
+
+
+def probe_changes(db, args, session=None):
+    """Request the first page of every folder type, the one a regular run would examine first.
+    Returns None when all of them, and the --page-size, --lookback and --fetch-limit they were
+    examined with, are as they were at the start of the last successful run, otherwise the new
+    high-water marks, for the run to store once it has succeeded."""
+    with metrics.current().stage('probe'), _session_or_new(session, len(FOLDER_TYPES)) as session, \
+            ThreadPoolExecutor(max_workers=len(FOLDER_TYPES)) as executor:
+        futures = {source: executor.submit(high_water_mark, source, args.page_size, session, args.timeout)
+                   for source in FOLDER_TYPES}
+        marks = {source: future.result() for source, future in futures.items()}
+    # A larger lookback or fetch limit reaches entries the last run didn't consider
+    marks['settings'] = {'page_size': args.page_size, 'lookback': args.lookback, 'fetch_limit': args.fetch_limit}
+    if marks == json.loads(db.get_meta(HIGH_WATER_META, 'null')):
+        return None
+    return marks
+
+
+def ingest(db, args, cache=None, session=None, make_jira_api=JiraApi):
+    """Fetch, filter and insert whatever is new, update whatever changed, and send it to Jira.
+    `session` may be kept warm by the caller across calls, and so may the JiraApi returned by
+    `make_jira_api`, which is only called once there is something to send or update.
+    Returns the number of new and changed items.
+
+    Unless anchored by -l/-t/-n, forced with --force, offline or streaming, a run first probes
+    the first page of every type, and stops there if none changed since the last successful run.
+    A --stream window reaches past the first page, so what it would find can't be probed."""
+    run_metrics = metrics.current()
+    # One client for the whole run, rather than one per update batch and one for the drain
+    make_jira_api = functools.cache(make_jira_api)
+    earlier_held = _retry_held_updates(db, args, make_jira_api)
+
+    marks = None
+    if not (args.force or args.offline or args.stream
+            or args.last_law or args.last_takana or args.last_notification):
+        marks = probe_changes(db, args, session)
+        if marks is None:
+            logger.info('Nothing was published or changed since the last run')
+            run_metrics.incr('probe_unchanged')
+            # Rows queued by earlier runs may still be due for a retry
+            send_to_jira(db, [], args, make_jira_api)
+            _store_marks(db, None, args, earlier_held)
+            return 0
+
+    if args.last_law:
+        last_law = db.get_law(args.last_law)
+    else:
+        last_law = db.get_last_law()
 
-    threshold = last_num - lookback
-    if booklet_num >= threshold:
-        logger.debug(f'  insert {label} #{booklet_num}: >= threshold {threshold} (anchor={last_num}, lookback={lookback})')
-        return True
+    if args.last_takana:
+        last_takana = db.get_takana(args.last_takana)
     else:
-        logger.debug(f'  skip {label} #{booklet_num}: {booklet_num} < threshold {threshold} (anchor={last_num}, lookback={lookback})')
-        return False
+        last_takana = db.get_last_takana()
 
+    if args.last_notification:
+        last_notification = db.get_notification(args.last_notification)
+    else:
+        last_notification = db.get_last_notification()
+
+    law_threshold = lookback_threshold(last_law, args.lookback)
+    takana_threshold = lookback_threshold(last_takana, args.lookback)
+    notification_threshold = lookback_threshold(last_notification, args.lookback)
+    logger.debug(
+        f'anchor laws: booklet #{last_law["booklet_number"] if last_law else "none"} '
+        f'(lookback={args.lookback}, threshold={law_threshold})'
+    )
+    logger.debug(
+        f'anchor regulations: booklet #{last_takana["booklet_number"] if last_takana else "none"} '
+        f'(threshold={takana_threshold})'
+    )
+    logger.debug(
+        f'anchor notifications: booklet #{last_notification["booklet_number"] if last_notification else "none"} '
+        f'(threshold={notification_threshold})'
+    )
 
-def main():
+    if args.stream:
+        # One type at a time: the streams insert as they go, over a single connection
+        all_items = []
+        changed = []
+        held = []
+        with run_metrics.stage('stream'), _session_or_new(session, 1) as session:
+            for source, booklet_type, threshold in [
+                ('laws', 'law', law_threshold),
+                ('takanot', 'takana', takana_threshold),
+                ('notifications', 'notification', notification_threshold),
+            ]:
+                inserted, updated, not_updated = stream_new(db, source, booklet_type, threshold, args.stream,
+                                                            args, session, make_jira_api)
+                all_items.extend(inserted)
+                changed.extend(updated)
+                held.extend(not_updated)
+        send_to_jira(db, all_items, args, make_jira_api)
+        fetch_documents(db, all_items + changed, args)
+        _store_marks(db, marks, args, _still_held(earlier_held, changed, held))
+        return len(all_items) + len(changed)
+
+    # The three folder types are independent, so page through them concurrently
+    # over one keep-alive pool; pages within a type stay sequential because
+    # each one decides whether the next is needed. Dedup, the duplicate check against the
+    # DB, the lookback threshold and the content hash comparison happen in one query per page.
+    settings_changed = _settings_changed(db, args)
+    with _session_or_new(session, args.workers) as session, \
+            ThreadPoolExecutor(max_workers=args.workers) as executor:
+        laws_future = executor.submit(
+            fetch_new, db, 'laws', 'law', law_threshold, args.page_size, session, args.timeout,
+            _page_cache(cache, args, args.last_law or settings_changed), args.offline, args.fetch_limit)
+        takanot_future = executor.submit(
+            fetch_new, db, 'takanot', 'takana', takana_threshold, args.page_size, session, args.timeout,
+            _page_cache(cache, args, args.last_takana or settings_changed), args.offline, args.fetch_limit)
+        notifications_future = executor.submit(
+            fetch_new, db, 'notifications', 'notification', notification_threshold, args.page_size,
+            session, args.timeout, _page_cache(cache, args, args.last_notification or settings_changed),
+            args.offline, args.fetch_limit)
+        laws, changed, unhashed = laws_future.result()
+        takanot, takanot_changed, takanot_unhashed = takanot_future.result()
+        notifications, notifications_changed, notifications_unhashed = notifications_future.result()
+    run_metrics.incr('rows_filtered', len(laws) + len(takanot) + len(notifications))
+
+    # Entries already stored may have been corrected since
+    changed, held = _update_changed(db, changed + takanot_changed + notifications_changed,
+                                    unhashed + takanot_unhashed + notifications_unhashed, args, make_jira_api)
+
+    def _summary_line(label, items):
+        if items:
+            numbers = ', '.join(str(i['booklet_number']) for i in items)
+            return f'  {len(items)} new {label}: {numbers}'
+        return f'  0 new {label}'
+
+    logger.info('Retrieved:\n' + '\n'.join([
+        _summary_line('laws', laws),
+        _summary_line('regulations', takanot),
+        _summary_line('notifications', notifications),
+        f'  {len(changed)} changed since stored',
+    ]))
+
+    all_items = list(laws)
+    all_items.extend(takanot)
+    all_items.extend(notifications)
+    all_items = _insert_batch(db, all_items, args.dry_run)
+
+    send_to_jira(db, all_items, args, make_jira_api)
+    fetch_documents(db, all_items + changed, args)
+    _store_marks(db, marks, args, _still_held(earlier_held, changed, held))
+    return len(all_items) + len(changed)
+
+
+def _retry_held_updates(db, args, make_jira_api):
+    """Retry the issue updates of the changed items earlier runs held back, and store those that
+    no longer need holding. Returns the ones still held. They are kept in a meta row rather than
+    left for the pages to show as changed again, so that a held row neither stops the probe nor
+    the page cache from cutting a run short."""
+    held = json.loads(db.get_meta(HELD_UPDATES_META, '[]'))
+    if not held:
+        return []
+    logger.info(f'Retrying the issue update of {len(held)} held changed item(s)')
+    _, held = _update_changed(db, held, [], args, make_jira_api)
+    return held
+
+
+def _still_held(earlier_held, stored, held):
+    """The changed items to hold for the next run: those this run held, and those held before
+    whose row it neither stored nor held in a newer version."""
+    newer = {item['id'] for item in stored + held}
+    return [item for item in earlier_held if item['id'] not in newer] + held
+
+
+def _store_marks(db, marks, args, held=()):
+    """Record the probed high-water marks for the next run to compare against, along with the
+    changed items held back for a failed Jira update, which the next run retries first."""
+    if args.dry_run:
+        return
+    db.set_meta(HELD_UPDATES_META, json.dumps(list(held), ensure_ascii=False))
+    if marks is not None:
+        db.set_meta(HIGH_WATER_META, json.dumps(marks))
+
+
+def _settings_changed(db, args):
+    """Whether --lookback or --fetch-limit differs from the one the last successful run examined
+    the pages with."""
+    settings = (json.loads(db.get_meta(HIGH_WATER_META, 'null')) or {}).get('settings', {})
+    return settings.get('lookback') != args.lookback or settings.get('fetch_limit') != args.fetch_limit
+
+
+def _page_cache(cache, args, rewalk):
+    """The cache to page through a type with. Online, a cached page that came back unchanged
+    ends the walk, which only holds when it covers what the walk that cached it did: when
+    `rewalk` (the type is anchored by -l/-t/-n, or --lookback or --fetch-limit changed), pages are requested
+    without it so older booklets get re-checked. Offline, the cache is the only source."""
+    if rewalk and not args.offline:
+        return None
+    return cache
+
+
+def _open_cache(args):
+    if args.no_cache:
+        return None
+    cache = ResponseCache(args.cache_dir)
+    if not args.offline:
+        cache.evict()
+    return cache
+
+
+def watch_forever(args):
+    """--watch: poll like a regular run, over and over, keeping the DB connection, the
+    Reshumot session and the page cache warm in between. Each poll is recorded as a run of
+    its own. The Jira client is made by the first poll that has something to send or update,
+    so watching needs no Jira credentials until then, and kept for the polls after it."""
+    cache = _open_cache(args)
+    schedule = watch.PollSchedule(args.interval, args.busy_interval, args.max_interval)
+    # Memoized, so every poll after the first that calls it shares its session and rate limiter
+    make_jira_api = functools.cache(JiraApi)
+    with database.Database() as db, make_session(args.workers) as session:
+        def poll():
+            with metrics.record_run('watch', db=db, textfile=args.metrics_textfile, profile=args.profile):
+                found_new = ingest(db, args, cache, session, make_jira_api)
+            if cache is not None and not args.dry_run and not args.offline:
+                cache.commit()
+            return found_new
+
+        logger.info(f'watching for new booklets (every {args.busy_interval // 60} min during '
+                    f'publishing hours, {args.interval // 60} min otherwise, backing off when idle)')
+        watch.run_forever(poll, schedule)
+
+
+def parse_booklet_numbers(spec):
+    """Parse a --resend spec such as `123,130-140` into a list of inclusive (first, last) ranges."""
+    ranges = []
+    for part in spec.split(','):
+        first, _, last = part.strip().partition('-')
+        try:
+            first = int(first)
+            last = int(last) if last else first
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'not a booklet number or range: {part!r}')
+        if last < first:
+            raise argparse.ArgumentTypeError(f'empty range: {part!r}')
+        ranges.append((first, last))
+    return ranges
+
+
+def resend(db, args):
+    """--resend / --resend-missing: send stored rows to Jira again, loaded with one query
+    and sent through the bulk endpoint, and record the keys of the new issues."""
+    if args.resend:
+        items = db.get_full_by_booklet_ranges(args.resend)
+        found = {item['booklet_number'] for item in items}
+        not_found = [number for first, last in args.resend for number in range(first, last + 1)
+                     if number not in found]
+        if not_found:
+            logger.warning(f'{len(not_found)} booklet(s) not found in DB: '
+                           f'{", ".join(str(n) for n in not_found[:50])}'
+                           + (', ...' if len(not_found) > 50 else ''))
+    else:
+        items = db.get_all_without_jira_key(from_booklet=args.resend_missing)
+    if args.resend and args.resend_missing is not None:
+        items = [item for item in items
+                 if item['jira_key'] is None and item['booklet_number'] >= args.resend_missing]
+    if not items:
+        logger.error('nothing to resend')
+        return
+    logger.info(f'resending {len(items)} row(s) of {len({item["booklet_number"] for item in items})} '
+                f'booklet(s) to Jira')
+    with metrics.current().stage('send'):
+        sent = JiraApi().send_bulk(items, dry_run=args.dry_run)
+    metrics.current().incr('rows_sent', len(sent))
+    db.complete_jira_deliveries((datum['id'], jira_key) for datum, jira_key in sent)
+    if not args.dry_run and len(sent) < len(items):
+        logger.error(f'{len(items) - len(sent)} row(s) could not be sent; run the same command again '
+                     f'or --resend-missing to retry them')
+
+
+def restart_archive(db, args):
+    """--archive-restart: forget the archive checkpoints of one type, or of all, so the crawl
+    goes over that history again from the first page."""
+    item_type = None if args.archive_restart == 'all' else db.booklet_types[args.archive_restart]
+    if args.dry_run:
+        print(f'[DRY RUN] would forget the archive checkpoints of {args.archive_restart}')
+        return
+    logger.info(f'forgetting the archive checkpoints of {args.archive_restart}')
+    db.clear_archive_pages(item_type)
+
+
+def run(args):
+    """Run the pipeline selected by the command line arguments."""
+    run_metrics = metrics.current()
+
+    if args.resend or args.resend_missing is not None:
+        with database.Database() as db:
+            resend(db, args)
+        return
+
+    if args.archive or args.archive_restart:
+        with database.Database() as db, make_session(args.workers) as session, \
+                run_metrics.stage('archive'):
+            if args.archive_restart:
+                restart_archive(db, args)
+            for source, booklet_type in [('laws', 'law'), ('takanot', 'takana'),
+                                         ('notifications', 'notification')]:
+                archive.crawl(db, source, booklet_type, session, workers=args.workers,
+                              page_size=args.archive_page_size, timeout=args.timeout,
+                              dry_run=args.dry_run)
+        logger.info('done')
+        return
+
+    cache = _open_cache(args)
+    with database.Database() as db:
+        ingest(db, args, cache)
+
+    # Only now that the pages have been ingested may they be skipped next time
+    if cache is not None and not args.dry_run and not args.offline:
+        cache.commit()
+
+    logger.info('done')
+
+
+def build_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('-l', '--last-law', type=int)
     parser.add_argument('-t', '--last-takana', type=int)
     parser.add_argument('-n', '--last-notification', type=int)
     parser.add_argument(
-        '--resend', type=int, metavar='BOOKLET_NUMBER',
-        help='Fetch this booklet from the DB and resend it to Jira without modifying the DB'
+        '--resend', type=parse_booklet_numbers, metavar='BOOKLETS',
+        help=(
+            'Fetch these booklets from the DB and resend them to Jira without fetching anything new; '
+            'a comma-separated list of booklet numbers and ranges, e.g. 123,130-140'
+        )
+    )
+    parser.add_argument(
+        '--resend-missing', type=int, metavar='BOOKLET_NUMBER',
+        help=(
+            'Resend every row from this booklet number on that has no Jira issue yet; '
+            'with --resend, only the rows of those booklets that have none'
+        )
     )
     parser.add_argument(
         '--lookback', type=int, default=DEFAULT_LOOKBACK,
@@ -73,11 +593,143 @@ def main():
             f'for gaps (default: {DEFAULT_LOOKBACK})'
         )
     )
+    parser.add_argument(
+        '--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+        help=(
+            f'How many records to request per API page; paging stops at the first page '
+            f'with nothing new (default: {DEFAULT_PAGE_SIZE})'
+        )
+    )
+    parser.add_argument(
+        '--fetch-limit', type=int, default=DEFAULT_FETCH_LIMIT,
+        help=f'Most records of each type to page through in one run (default: {DEFAULT_FETCH_LIMIT})'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=DEFAULT_POOL_SIZE,
+        help=(
+            f'Maximum number of concurrent requests to the Reshumot API '
+            f'(default: {DEFAULT_POOL_SIZE}, one per folder type)'
+        )
+    )
+    parser.add_argument(
+        '--timeout', type=float, default=DEFAULT_TIMEOUT,
+        help=f'Timeout in seconds for each Reshumot API request (default: {DEFAULT_TIMEOUT})'
+    )
+    parser.add_argument(
+        '--stream', type=int, metavar='WINDOW',
+        help=(
+            'Instead of paging, stream the latest WINDOW records of each type in one request '
+            'and insert them as they are parsed; meant for large back-fill windows'
+        )
+    )
+    parser.add_argument(
+        '--archive', action='store_true',
+        help=(
+            'Import the full Reshumot history of every type into the DB (without sending to Jira), '
+            'resuming from the checkpoints of an interrupted crawl; --workers sets the number '
+            'of concurrent page fetches'
+        )
+    )
+    parser.add_argument(
+        '--archive-restart', nargs='?', const='all', choices=['all', 'law', 'takana', 'notification'],
+        metavar='TYPE',
+        help=(
+            'Like --archive, but first forget the checkpoints of TYPE (law, takana or notification; '
+            'default: all), to crawl a finished or shifted archive again'
+        )
+    )
+    parser.add_argument(
+        '--archive-page-size', type=int, default=archive.ARCHIVE_PAGE_SIZE,
+        help=f'Records per page in --archive mode (default: {archive.ARCHIVE_PAGE_SIZE})'
+    )
+    parser.add_argument(
+        '--force', action='store_true',
+        help=(
+            'Fetch the usual pages even if probing the first page of every type shows '
+            'nothing changed since the last run'
+        )
+    )
+    parser.add_argument(
+        '--cache-dir', default=DEFAULT_CACHE_DIR,
+        help=f'Where to keep raw API pages and their fingerprints (default: {DEFAULT_CACHE_DIR})'
+    )
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help='Do not cache API pages, and process every fetched page even if it is unchanged'
+    )
+    parser.add_argument(
+        '--offline', action='store_true',
+        help='Replay the API pages cached by a previous run instead of calling the API'
+    )
     parser.add_argument(
         '--dry-run', action='store_true',
         help='Preview what would be inserted into the DB and sent to Jira, without doing either'
     )
+    parser.add_argument(
+        '--update-jira', action='store_true',
+        help='Also update the Jira issues of entries whose content changed since they were stored; '
+             'an entry whose update fails in a way that may pass (429, 5xx, no connection) is '
+             'stored once a later run updates it'
+    )
+    parser.add_argument(
+        '--no-drain', action='store_true',
+        help=(
+            'Only queue new items in the Jira outbox, without sending them; '
+            'outbox.py sends them separately'
+        )
+    )
+    parser.add_argument(
+        '--fetch-documents', action='store_true',
+        help='Also download the PDFs of new and changed booklets into the local document store'
+    )
+    parser.add_argument(
+        '--document-store', default=documents.DEFAULT_STORE_DIR,
+        help=f'--fetch-documents: directory of the document store (default: {documents.DEFAULT_STORE_DIR})'
+    )
+    parser.add_argument(
+        '--document-workers', type=int, default=documents.DEFAULT_WORKERS,
+        help=f'--fetch-documents: number of concurrent downloads (default: {documents.DEFAULT_WORKERS})'
+    )
+    parser.add_argument(
+        '--watch', action='store_true',
+        help='Keep running and poll for new booklets, more often during publishing hours'
+    )
+    parser.add_argument(
+        '--interval', type=int, default=watch.DEFAULT_INTERVAL,
+        help=f'--watch: seconds between polls outside publishing hours (default: {watch.DEFAULT_INTERVAL})'
+    )
+    parser.add_argument(
+        '--busy-interval', type=int, default=watch.DEFAULT_BUSY_INTERVAL,
+        help=(
+            f'--watch: seconds between polls during publishing hours '
+            f'(default: {watch.DEFAULT_BUSY_INTERVAL})'
+        )
+    )
+    parser.add_argument(
+        '--max-interval', type=int, default=watch.DEFAULT_MAX_INTERVAL,
+        help=(
+            f'--watch: longest wait between polls after backing off while nothing changes '
+            f'(default: {watch.DEFAULT_MAX_INTERVAL})'
+        )
+    )
+    parser.add_argument(
+        '--metrics-textfile', metavar='PATH',
+        help='Also write the run metrics to this file in the Prometheus textfile format'
+    )
+    parser.add_argument(
+        '--profile', metavar='DIR',
+        help=(
+            'Profile every stage with cProfile and tracemalloc and write the results to DIR: '
+            'a pstats file and the top allocation sites per stage, and a summary of wall against '
+            'CPU time; with --watch, of the latest poll'
+        )
+    )
     parser.add_argument('--log')
+    return parser
+
+
+def main():
+    parser = build_parser()
     args = parser.parse_args()
 
     log = {
@@ -90,139 +742,20 @@ def main():
     if args.log:
         logging.basicConfig(level=log[args.log])
 
-    if args.resend:
-        with database.Database() as db:
-            items = db.get_full_by_booklet_number(args.resend)
-            if not items:
-                logger.error(f'booklet #{args.resend} not found in DB')
-                return
-            logger.info(f'resending booklet #{args.resend} to Jira ({len(items)} row(s))')
-            jira_api = JiraApi()
-            sent = jira_api.send(items, dry_run=args.dry_run)
-            for datum, jira_key in sent:
-                db.update_jira_key_by_id(datum['id'], jira_key)
-        return
-
-    laws_dict = get_html('laws', DEFAULT_FETCH_LIMIT)
-    takanot_dict = get_html('takanot', DEFAULT_FETCH_LIMIT)
-    notifications_dict = get_html('notifications', DEFAULT_FETCH_LIMIT)
+    if args.offline and args.no_cache:
+        parser.error('--offline needs the cache; it cannot be combined with --no-cache')
+    if args.offline and (args.stream or args.archive or args.archive_restart):
+        parser.error('--stream and --archive always call the API; they cannot be combined with --offline')
 
-    logger.debug(f'API returned: {len(laws_dict["Results"])} laws, '
-                 f'{len(takanot_dict["Results"])} regulations, '
-                 f'{len(notifications_dict["Results"])} notifications')
-
-    laws = list(clean_data(laws_dict, 'law'))
-    takanot = list(clean_data(takanot_dict, 'takana'))
-    notifications = list(clean_data(notifications_dict, 'notification'))
-
-    logger.debug(f'after clean_data: {len(laws)} law entries, '
-                 f'{len(takanot)} regulation entries, '
-                 f'{len(notifications)} notification entries')
-
-    # Deduplicate within each batch: the API can return the same entry twice.
-    # Key by (booklet_number, display_name) so different laws within the same
-    # booklet are kept as separate entries.
-    def dedup(items):
-        seen = {}
-        for item in items:
-            seen[(item['booklet_number'], item['display_name'])] = item
-        return list(seen.values())
-
-    laws = dedup(laws)
-    takanot = dedup(takanot)
-    notifications = dedup(notifications)
-
-    logger.debug(f'after dedup: {len(laws)} laws, {len(takanot)} regulations, {len(notifications)} notifications')
-
-    with database.Database() as db:
-
-        if args.last_law:
-            last_law = db.get_law(args.last_law)
-        else:
-            last_law = db.get_last_law()
-
-        if args.last_takana:
-            last_takana = db.get_takana(args.last_takana)
-        else:
-            last_takana = db.get_last_takana()
-
-        if args.last_notification:
-            last_notification = db.get_notification(args.last_notification)
-        else:
-            last_notification = db.get_last_notification()
-
-        existing_law_entries = db.get_all_law_entries()
-        existing_takana_entries = db.get_all_takana_entries()
-        existing_notification_entries = db.get_all_notification_entries()
-
-        logger.debug(
-            f'anchor laws: booklet #{last_law["booklet_number"] if last_law else "none"} '
-            f'(lookback={args.lookback}, threshold='
-            f'{int(last_law["booklet_number"]) - args.lookback if last_law else "n/a"})'
-        )
-        logger.debug(
-            f'anchor regulations: booklet #{last_takana["booklet_number"] if last_takana else "none"}'
-        )
-        logger.debug(
-            f'anchor notifications: booklet #{last_notification["booklet_number"] if last_notification else "none"}'
-        )
-        logger.debug(
-            f'existing in DB: {len(existing_law_entries)} law entries, '
-            f'{len(existing_takana_entries)} regulation entries, '
-            f'{len(existing_notification_entries)} notification entries'
-        )
-
-        laws = [law for law in laws
-                if should_insert_booklet(last_law, law, existing_law_entries, args.lookback)]
-        takanot = [takana for takana in takanot
-                   if should_insert_booklet(last_takana, takana, existing_takana_entries, args.lookback)]
-        notifications = [notification for notification in notifications
-                         if should_insert_booklet(last_notification, notification, existing_notification_entries, args.lookback)]
-
-        def _summary_line(label, items):
-            if items:
-                numbers = ', '.join(str(i['booklet_number']) for i in items)
-                return f'  {len(items)} new {label}: {numbers}'
-            return f'  0 new {label}'
-
-        logger.info('Retrieved:\n' + '\n'.join([
-            _summary_line('laws', laws),
-            _summary_line('regulations', takanot),
-            _summary_line('notifications', notifications),
-        ]))
-
-        for law in laws:
-            if args.dry_run:
-                print(f'[DRY RUN] would insert law: {law["booklet_number"]} – {law["display_name"]}')
-            else:
-                law['id'] = db.insert_law(law)
-
-        for takana in takanot:
-            if args.dry_run:
-                print(f'[DRY RUN] would insert takana: {takana["booklet_number"]} – {takana["display_name"]}')
-            else:
-                takana['id'] = db.insert_takana(takana)
-
-        for notification in notifications:
-            if args.dry_run:
-                print(f'[DRY RUN] would insert notification: {notification["booklet_number"]} – {notification["display_name"]}')
-            else:
-                notification['id'] = db.insert_notification(notification)
-
-        all_items = list(laws)
-        all_items.extend(takanot)
-        all_items.extend(notifications)
-        if all_items:
-            logger.info(f'Sending {len(all_items)} item(s) to Jira')
-            if args.dry_run:
-                print(f'[DRY RUN] would send {len(all_items)} item(s) to Jira')
-            else:
-                jira_api = JiraApi()
-                sent = jira_api.send(all_items)
-                for datum, jira_key in sent:
-                    db.update_jira_key_by_id(datum['id'], jira_key)
+    if args.watch:
+        if args.resend or args.resend_missing is not None or args.archive or args.archive_restart \
+                or args.offline:
+            parser.error('--watch cannot be combined with --resend, --archive or --offline')
+        watch_forever(args)
+        return
 
-    logger.info('done')
+    with metrics.record_run('main', textfile=args.metrics_textfile, profile=args.profile):
+        run(args)
 
 
 if __name__ == '__main__':
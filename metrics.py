@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+from profiling import StageProfiler
+
+
+logger = logging.getLogger(__name__)
+
+
+class RunMetrics:
+    """Stage durations and counters of one run of a script.
+
+    Counters are plain names, e.g. http_requests, http_bytes, http_429, retries,
+    rows_fetched, rows_inserted, db_commit_seconds. They can be bumped from any
+    thread; stages are timed with the stage() context manager."""
+
+    def __init__(self, script):
+        self.script = script
+        self.started_at = datetime.now(timezone.utc)
+        self.stages = {}
+        self.counters = {}
+        self.profiler = None  # a profiling.StageProfiler, with --profile
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        # The profiler's own overhead stays outside the stage's time
+        with nullcontext() if self.profiler is None else self.profiler.stage(name):
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def merge(self, data):
+        """Add the stages and counters of another run's as_dict(), e.g. a worker process's."""
+        for name, seconds in data['stages'].items():
+            self.add_stage(name, seconds)
+        for name, value in data['counters'].items():
+            self.incr(name, value)
+
+    def record_response(self, res, size=None):
+        """Count an HTTP response: one request, its body size and, if any, its 429."""
+        self.incr('http_requests')
+        self.incr('http_bytes', len(res.content) if size is None else size)
+        if res.status_code == 429:
+            self.incr('http_429')
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'stages': {name: round(seconds, 4) for name, seconds in self.stages.items()},
+                'counters': {name: round(value, 4) if isinstance(value, float) else value
+                             for name, value in self.counters.items()},
+            }
+
+    def write_textfile(self, path, status):
+        """Write the metrics in the Prometheus text format, for the node exporter's textfile collector."""
+        data = self.as_dict()
+        labels = f'script="{self.script}"'
+        lines = [
+            '# TYPE kolzchut_ingest_last_run_timestamp_seconds gauge',
+            f'kolzchut_ingest_last_run_timestamp_seconds{{{labels}}} {self.started_at.timestamp():.0f}',
+            '# TYPE kolzchut_ingest_last_run_success gauge',
+            f'kolzchut_ingest_last_run_success{{{labels}}} {int(status == "ok")}',
+            '# TYPE kolzchut_ingest_stage_seconds gauge',
+        ]
+        lines += [f'kolzchut_ingest_stage_seconds{{{labels},stage="{name}"}} {seconds}'
+                  for name, seconds in data['stages'].items()]
+        for name, value in sorted(data['counters'].items()):
+            lines += [f'# TYPE kolzchut_ingest_{name} gauge', f'kolzchut_ingest_{name}{{{labels}}} {value}']
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+
+_current = RunMetrics(None)
+
+
+def current():
+    """The metrics of the run in progress. Outside record_run() they go nowhere."""
+    return _current
+
+
+def _new_run(script, profile):
+    run = RunMetrics(script)
+    if profile:
+        run.profiler = StageProfiler(profile)
+        run.profiler.start()
+    return run
+
+
+def _write_profile(run):
+    if run.profiler is not None:
+        try:
+            run.profiler.write()
+        except Exception:
+            logger.exception('failed to write the profile')
+
+
+@contextmanager
+def collect(script, profile=None):
+    """Collect metrics for the body of the block without recording them; for a worker
+    process, whose parent merges the as_dict() of the yielded RunMetrics into its own run.
+    `profile` is as for record_run()."""
+    global _current
+    run = _current = _new_run(script, profile)
+    try:
+        yield run
+    finally:
+        _current = RunMetrics(None)
+        _write_profile(run)
+
+
+@contextmanager
+def record_run(script, db=None, textfile=None, profile=None):
+    """Collect metrics for the body of the block, then store them in the `run` table and,
+    if `textfile` is given, as a Prometheus textfile, whether the run succeeded or not.
+    `db` is an open database.Database to store them with; by default one is opened.
+    With `profile`, a directory, every stage is also profiled there (see profiling.py)."""
+    global _current
+    run = _current = _new_run(script, profile)
+    status = 'error'
+    try:
+        yield run
+        status = 'ok'
+    finally:
+        _current = RunMetrics(None)
+        _write_profile(run)
+        finished_at = datetime.now(timezone.utc)
+        try:
+            import database
+            with nullcontext(db) if db is not None else database.Database() as run_db:
+                run_db.insert_run(script, run.started_at.isoformat(), finished_at.isoformat(),
+                                  (finished_at - run.started_at).total_seconds(), status,
+                                  json.dumps(run.as_dict()))
+            if textfile:
+                run.write_textfile(textfile, status)
+        except Exception:
+            logger.exception('failed to record run metrics')
+        logger.info(f'{script} run {status} in {(finished_at - run.started_at).total_seconds():.1f}s: '
+                    f'{json.dumps(run.as_dict())}')
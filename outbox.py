@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Deliver the Jira outbox.
+
+main.py queues every row it inserts in the jira_outbox table, in the same
+transaction as the insert. This drains the queue: due rows are sent to Jira in
+bulk batches, and each row created in Jira leaves the queue in the same
+transaction that records its jira_key. A row Jira doesn't create stays queued
+and is retried later, with an exponentially growing delay; nothing is dropped.
+Each drain claims the rows it sends for CLAIM_LEASE seconds, so drains that
+overlap never send the same row twice.
+
+main.py drains the outbox itself after ingesting unless run with --no-drain;
+this script is for draining it separately, e.g. from its own cron job.
+"""
+
+import argparse
+import logging
+
+import requests
+
+import database
+import metrics
+from jira import DEFAULT_RATE, DEFAULT_WORKERS, JiraApi
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 200  # rows taken off the queue per round, sent as several bulk requests
+RETRY_BASE_DELAY = 60  # seconds before the first retry of a row; doubles with every failure
+RETRY_MAX_DELAY = 6 * 60 * 60
+STUCK_ATTEMPTS = 5  # warn about the queue once a row has failed this many times
+CLAIM_LEASE = 15 * 60  # seconds a drain holds the rows it took before another may send them
+
+
+def drain(db, make_jira_api=None, batch_size=DEFAULT_BATCH_SIZE, dry_run=False,
+          workers=DEFAULT_WORKERS, rate=DEFAULT_RATE):
+    """Send every due row of the outbox to Jira. Returns the number of issues created.
+    The JiraApi to send with is only made, by calling `make_jira_api` or else with `workers`
+    and `rate`, if a row is due, so a run with nothing to send needs no Jira credentials."""
+    run_metrics = metrics.current()
+    if dry_run:
+        rows = db.get_due_jira_deliveries(batch_size)
+        print(f'[DRY RUN] would send {len(rows)} queued row(s) to Jira'
+              + (' (first batch only)' if len(rows) == batch_size else ''))
+        return 0
+
+    # Made before claiming anything: rows claimed by a drain that then fails to make its
+    # client (e.g. without credentials) would sit leased and unsent for CLAIM_LEASE
+    jira_api = None
+    if db.get_due_jira_deliveries(1):
+        jira_api = make_jira_api() if make_jira_api else JiraApi(workers=workers, rate=rate)
+    # Claimed rather than read, as main.py and outbox.py may drain at the same time
+    rows = db.claim_jira_deliveries(batch_size, CLAIM_LEASE) if jira_api is not None else []
+    sent_total = 0
+    while rows:
+        # backfill_jira_keys.py may have found the issue of a queued row in the meantime
+        done = [(row['id'], row['jira_key']) for row in rows if row['jira_key']]
+        rows = [row for row in rows if not row['jira_key']]
+        logger.info(f'Sending {len(rows)} queued row(s) to Jira')
+        sent = []
+        with run_metrics.stage('send'):
+            try:
+                sent = jira_api.send_bulk(rows)
+            except requests.RequestException as e:
+                logger.error(f'Jira unreachable ({e}), leaving {len(rows)} row(s) queued')
+        done.extend((datum['id'], jira_key) for datum, jira_key in sent)
+        db.complete_jira_deliveries(done)
+        run_metrics.incr('rows_sent', len(sent))
+        sent_total += len(sent)
+
+        sent_ids = {datum['id'] for datum, _ in sent}
+        failed = [row['id'] for row in rows if row['id'] not in sent_ids]
+        if failed:
+            # Postponed, so the next round won't pick them up again
+            db.retry_jira_deliveries(failed, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+            run_metrics.incr('rows_send_failed', len(failed))
+        if not sent and rows:
+            break  # Jira is refusing everything; retry the rest later
+        rows = db.claim_jira_deliveries(batch_size, CLAIM_LEASE)
+
+    pending, oldest, attempts = db.get_jira_outbox_status()
+    run_metrics.incr('outbox_pending', pending)
+    if pending:
+        log = logger.warning if attempts >= STUCK_ATTEMPTS else logger.info
+        log(f'{pending} row(s) still queued for Jira, the oldest since {oldest} UTC '
+            f'(up to {attempts} failed attempt(s))')
+    return sent_total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+        help=f'Queued rows taken per round (default: {DEFAULT_BATCH_SIZE})'
+    )
+    parser.add_argument(
+        '--retry-now', action='store_true',
+        help='Make every queued row due right away, ignoring the retry delays'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=DEFAULT_WORKERS,
+        help=f'Number of concurrent Jira requests (default: {DEFAULT_WORKERS})'
+    )
+    parser.add_argument(
+        '--rate', type=float, default=DEFAULT_RATE,
+        help=f'Maximum Jira requests per second across all workers (default: {DEFAULT_RATE})'
+    )
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would be sent')
+    parser.add_argument(
+        '--metrics-textfile', metavar='PATH',
+        help='Also write the run metrics to this file in the Prometheus textfile format'
+    )
+    parser.add_argument('--log', default='info')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log.upper()))
+
+    with database.Database() as db, metrics.record_run('outbox', db=db, textfile=args.metrics_textfile):
+        if args.retry_now:
+            db.reset_jira_retry_delays()
+        sent = drain(db, batch_size=args.batch_size, dry_run=args.dry_run,
+                     workers=args.workers, rate=args.rate)
+        logger.info(f'done: {sent} issue(s) created')
+
+
+if __name__ == '__main__':
+    main()
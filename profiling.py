@@ -0,0 +1,133 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+TRACEMALLOC_FRAMES = 1  # the allocating line; deeper tracebacks make every allocation slower
+SNAPSHOTS_PER_STAGE = 10  # snapshots cost ~0.1s each, so only the first calls of a stage are traced
+TOP_ALLOCATIONS = 25
+TOP_FUNCTIONS = 15
+# From 3.12, cProfile hooks into sys.monitoring, which is process-wide: a profile sees every
+# thread, and a second one can't be enabled while one is
+PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+
+class StageProfiler:
+    """cProfile and tracemalloc around every metrics stage of a run, for --profile.
+
+    Before Python 3.12, cProfile only sees the thread it runs in, so each thread entering
+    a stage gets its own profile. From 3.12 on, only the stages of the thread that started
+    the profiler are profiled, and their profiles include what the other threads did in the
+    meantime; the stages of other threads are only timed and traced. Either way, a stage
+    nested in another one of the same thread is counted in the outer one. Per stage, write()
+    leaves in `directory`:
+
+        <stage>.pstats     the merged profiles, for pstats or snakeviz
+        <stage>.alloc.txt  the lines that allocated the most memory during the stage (in
+                           its first SNAPSHOTS_PER_STAGE calls) and still held it at its end
+        summary.txt        wall time against CPU time, and the top functions of each stage
+
+    Wall time minus the CPU time of the stage's threads is time spent waiting, mostly
+    on the network (or on the threads the stage handed its work to)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._profiles = {}
+        self._allocations = {}
+        self._snapshots = {}
+        self._times = {}  # stage -> [wall seconds, CPU seconds]
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._owner = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._owner = threading.get_ident()
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def _enable_profile(self):
+        """Return an enabled cProfile.Profile for a stage the current thread enters, or None."""
+        if not PER_THREAD_PROFILES and threading.get_ident() != self._owner:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Another profiler is active, such as python -m cProfile around the whole script
+            logger.debug(f'not profiling the stage: {e}')
+            return None
+        return profile
+
+    @contextmanager
+    def stage(self, name):
+        if getattr(self._local, 'active', False):
+            yield
+            return
+        self._local.active = True
+        with self._lock:
+            traced = self._snapshots.get(name, 0) < SNAPSHOTS_PER_STAGE
+            if traced:
+                self._snapshots[name] = self._snapshots.get(name, 0) + 1
+        before = tracemalloc.take_snapshot() if traced else None
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        profile = self._enable_profile()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            cpu = time.thread_time() - cpu
+            wall = time.perf_counter() - wall
+            # Taken after the timings, as snapshots are slow themselves
+            stats = tracemalloc.take_snapshot().compare_to(before, 'lineno') if traced else []
+            self._local.active = False
+            with self._lock:
+                if profile is not None:
+                    self._profiles.setdefault(name, []).append(profile)
+                times = self._times.setdefault(name, [0.0, 0.0])
+                times[0] += wall
+                times[1] += cpu
+                allocations = self._allocations.setdefault(name, {})
+                for stat in stats:
+                    if stat.size_diff > 0:
+                        size, count = allocations.get(stat.traceback, (0, 0))
+                        allocations[stat.traceback] = (size + stat.size_diff, count + stat.count_diff)
+
+    def write(self):
+        """Stop tracing and write the per-stage files and the summary."""
+        tracemalloc.stop()
+        summary = [f'{"stage":<20} {"wall s":>10} {"CPU s":>10} {"waiting s":>10}']
+        details = []
+        for name, (wall, cpu) in sorted(self._times.items()):
+            summary.append(f'{name:<20} {wall:>10.3f} {cpu:>10.3f} {max(wall - cpu, 0):>10.3f}')
+
+            profiles = self._profiles.get(name)
+            if profiles:
+                stats = pstats.Stats(profiles[0])
+                for profile in profiles[1:]:
+                    stats.add(profile)
+                stats.dump_stats(os.path.join(self.directory, f'{name}.pstats'))
+                out = stats.stream = io.StringIO()
+                stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+                details.append(f'\n== {name} ==\n{out.getvalue().strip()}\n')
+
+            top = sorted(self._allocations[name].items(), key=lambda site: site[1][0], reverse=True)
+            with open(os.path.join(self.directory, f'{name}.alloc.txt'), 'w') as f:
+                for traceback, (size, count) in top[:TOP_ALLOCATIONS]:
+                    f.write(f'{size / 1024:.1f} KiB in {count} block(s)\n')
+                    f.writelines(f'    {line}\n' for line in traceback.format())
+
+        with open(os.path.join(self.directory, 'summary.txt'), 'w') as f:
+            f.write('\n'.join(summary) + '\n' + ''.join(details))
+        logger.info('profile written to ' + os.path.join(self.directory, 'summary.txt') + ':\n'
+                    + '\n'.join(summary))
@@ -1,35 +1,202 @@
+import codecs
+import hashlib
+import json
 import logging
+import os
+import re
 
 import requests
+from requests.adapters import HTTPAdapter
 import urllib3
 
+import metrics
+
 
 urllib3.disable_warnings()
 
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_PAGE_SIZE = 25
+DEFAULT_TIMEOUT = 30  # seconds, for both connect and read
+DEFAULT_POOL_SIZE = 3
+STREAM_CHUNK_SIZE = 64 * 1024
 
-def get_html(source, limit=10, skip=0):
-    url = 'https://pub-justice.openapi.gov.il/pub/moj/portal/rest/searchpredefinedapi/v1/SearchPredefinedApi/Reshumot/Search'
-    folder_types = {
-        'laws': "1",
-        'notifications': "2",
-        'takanot': "3"
-    }
+FOLDER_TYPES = {
+    'laws': "1",
+    'notifications': "2",
+    'takanot': "3"
+}
+
+
+def make_session(pool_size=DEFAULT_POOL_SIZE):
+    """Return a requests.Session whose keep-alive pool can hold `pool_size` connections,
+    so concurrent fetches reuse TLS connections instead of opening one per request."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+SEARCH_URL = os.environ.get(
+    'RESHUMOT_SEARCH_URL',
+    'https://pub-justice.openapi.gov.il/pub/moj/portal/rest/searchpredefinedapi/v1/SearchPredefinedApi/Reshumot/Search'
+)
+
+# This is the key used by the gov.il website currently
+HEADERS = {'x-client-id': '149a5bad-edde-49a6-9fb9-188bd17d4788'}
 
-    # This is the key used by the gov.il website currently
-    headers = {'x-client-id': '149a5bad-edde-49a6-9fb9-188bd17d4788'}
+_RESULTS_START = re.compile(r'"Results"\s*:\s*\[')
+_SEPARATORS = re.compile(r'[\s,]*')
 
+
+def _post(source, limit, skip, session=None, timeout=DEFAULT_TIMEOUT, stream=False):
     data = {
         "skip": skip,
         "limit": str(limit),
-        "FolderType": folder_types[source]
+        "FolderType": FOLDER_TYPES[source]
     }
+    return (session or requests).post(SEARCH_URL, json=data, headers=HEADERS, timeout=timeout, stream=stream)
+
+
+def get_html(source, limit=10, skip=0, session=None, timeout=DEFAULT_TIMEOUT, cache=None):
+    """POST one Search API query and return the decoded page.
 
-    res = requests.post(url, json=data, headers=headers)
+    With a `cache`, the raw body is stored there as well, and the returned page
+    carries an `unchanged` flag telling whether it matches the last committed run."""
+    res = _post(source, limit, skip, session=session, timeout=timeout)
+    metrics.current().record_response(res)
 
     if res.status_code == 200:
-        return res.json()
+        page = res.json()
+        if cache is not None:
+            changed = cache.put(FOLDER_TYPES[source], skip, limit, res.content)
+            page['unchanged'] = not changed
+        return page
     logger.error(f"We didn't get 200 from {source}, we got {res.status_code}")
     raise SystemExit(f'We got {res.status_code} from {source}')
+
+
+def iter_records(chunks):
+    """Incrementally parse the records of the "Results" array out of a Search API
+    response body given as an iterable of byte chunks, yielding each record as soon
+    as it is complete. Only the current, unparsed part of the body is held in memory."""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    position = None  # index in buffer just inside the Results array, once found
+    exhausted = False
+    while True:
+        if position is None:
+            match = _RESULTS_START.search(buffer)
+            if match:
+                position = match.end()
+        else:
+            position = _SEPARATORS.match(buffer, position).end()
+            if buffer.startswith(']', position):
+                return
+            if position < len(buffer):
+                try:
+                    record, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if exhausted:
+                        raise
+                else:
+                    yield record
+                    position = end
+                    continue
+        if exhausted:
+            if position is None:
+                # No Results array at all: treat it as an empty page
+                return
+            raise ValueError('Search API response ended inside the Results array')
+        if position:
+            # Drop what has been parsed before growing the buffer
+            buffer = buffer[position:]
+            position = 0
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            buffer += utf8.decode(b'', final=True)
+        else:
+            buffer += utf8.decode(chunk)
+
+
+def stream_results(source, limit=10, skip=0, session=None, timeout=DEFAULT_TIMEOUT):
+    """Like get_html, but yield the page's records one by one, newest first, while the
+    response body is still downloading instead of decoding it all at once."""
+    res = _post(source, limit, skip, session=session, timeout=timeout, stream=True)
+    run = metrics.current()
+    run.record_response(res, size=0)
+
+    def counted(chunks):
+        for chunk in chunks:
+            run.incr('http_bytes', len(chunk))
+            yield chunk
+
+    with res:
+        if res.status_code != 200:
+            logger.error(f"We didn't get 200 from {source}, we got {res.status_code}")
+            raise SystemExit(f'We got {res.status_code} from {source}')
+        yield from iter_records(counted(res.iter_content(STREAM_CHUNK_SIZE)))
+
+
+def get_cached_html(source, limit=10, skip=0, cache=None):
+    """Replay a page stored by a previous online run, ignoring its age.
+    Returns an empty page if it was never cached."""
+    page = cache.get(FOLDER_TYPES[source], skip, limit)
+    if page is None:
+        logger.warning(f'{source}: no cached page for skip={skip} limit={limit}')
+        return {'Results': []}
+    return page
+
+
+def high_water_mark(source, page_size=DEFAULT_PAGE_SIZE, session=None, timeout=DEFAULT_TIMEOUT):
+    """Request the first page of `source`, as a regular run would, and return its high-water
+    mark: the newest booklet number, the latest modification date and a fingerprint of all the
+    page's records, or None if there is no record. Equal marks mean nothing on the page was
+    published or edited since."""
+    results = get_html(source, limit=page_size, session=session, timeout=timeout).get('Results') or []
+    if not results:
+        return None
+    data = [result.get('Data') or {} for result in results]
+    return {
+        'booklet_number': max((datum.get('BookletNum') or 0 for datum in data), default=None),
+        'modify_date': max((datum.get('ModifyDate') or '' for datum in data), default=None),
+        'fingerprint': hashlib.sha256(json.dumps(results, sort_keys=True).encode()).hexdigest(),
+    }
+
+
+def iter_pages(source, page_size=DEFAULT_PAGE_SIZE, max_records=None, stop=None,
+               session=None, timeout=DEFAULT_TIMEOUT, cache=None, offline=False):
+    """Walk the Search API newest-first in pages of `page_size` records, yielding each raw page.
+
+    Stops after a short (last) page, once `max_records` have been requested, or
+    after a page for which `stop(page)` returns True. The stopping page is still
+    yielded so the caller can process whatever is new on it.
+
+    With a `cache`, a page identical to the one seen at the same offset in the
+    last committed run is not yielded and ends the walk: it, and everything
+    below it, was already processed. With `offline`, pages are replayed from the
+    cache instead of requested."""
+    skip = 0
+    while max_records is None or skip < max_records:
+        limit = page_size if max_records is None else min(page_size, max_records - skip)
+        if offline:
+            page = get_cached_html(source, limit, skip, cache)
+        else:
+            page = get_html(source, limit, skip, session=session, timeout=timeout, cache=cache)
+        results = page.get('Results') or []
+        logger.debug(f'{source}: page skip={skip} limit={limit} returned {len(results)} record(s)')
+        if page.get('unchanged'):
+            logger.debug(f'{source}: page skip={skip} unchanged since the last run, stopping')
+            return
+        yield page
+        if len(results) < limit:
+            return
+        if stop and stop(page):
+            logger.debug(f'{source}: stopping after skip={skip}, nothing new on this page')
+            return
+        skip += limit
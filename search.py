@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Search the stored booklets by display name and description.
+
+Answers questions like "has law X been amended since date Y?":
+
+    ./search.py 'חוק העונשין תיקון' --since 2021-01-01
+
+Niqqud, geresh and gershayim are ignored on both sides, so התשפ"א, התשפ״א and
+התשפא find the same rows. Every word must match; the last one also matches as
+a prefix. Results are ranked by relevance, with matches in the display name
+ranking above matches in the description.
+"""
+
+import argparse
+import json
+import logging
+
+import database
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('query', nargs='+', help='Words to look for')
+    parser.add_argument('--since', metavar='YYYY-MM-DD', help='Only booklets published on or after this date')
+    parser.add_argument('--until', metavar='YYYY-MM-DD', help='Only booklets published on or before this date')
+    parser.add_argument('--type', choices=list(database.Database.booklet_types), help='Only this booklet type')
+    parser.add_argument(
+        '--limit', type=int, default=DEFAULT_LIMIT,
+        help=f'Show at most this many results (default: {DEFAULT_LIMIT})'
+    )
+    parser.add_argument('--json', action='store_true', help='Print the matching rows as JSON lines')
+    parser.add_argument('--log', default='warning')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log.upper()))
+
+    with database.Database() as db:
+        item_type = db.booklet_types[args.type] if args.type else None
+        rows = db.search(' '.join(args.query), item_type=item_type, published_from=args.since,
+                         published_to=args.until, limit=args.limit)
+    types = {type_id: name for name, type_id in database.Database.booklet_types.items()}
+    for row in rows:
+        if args.json:
+            print(json.dumps(row, ensure_ascii=False))
+            continue
+        print(f'{(row["published_date"] or "")[:10]}  {types.get(row["booklet_type"], "?"):<12} '
+              f'#{row["booklet_number"]:<6} {row["jira_key"] or "-":<10} {row["display_name"]}')
+    if not rows:
+        logger.warning('no matches')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import logging
+import signal
+import threading
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 30 * 60  # seconds, outside publishing hours
+DEFAULT_BUSY_INTERVAL = 5 * 60  # seconds, during publishing hours
+DEFAULT_MAX_INTERVAL = 2 * 60 * 60
+IDLE_BACKOFF = 1.5  # the interval grows by this factor with every poll that finds nothing
+
+# Reshumot is published on Israeli working days, Sunday to Thursday, during office hours
+PUBLISHING_DAYS = {6, 0, 1, 2, 3}  # datetime.weekday(): Monday is 0, Sunday is 6
+PUBLISHING_HOURS = range(8, 20)
+
+
+def _israel_tz():
+    try:
+        return ZoneInfo('Asia/Jerusalem')
+    except ZoneInfoNotFoundError:
+        # No tz database on this machine; standard time is close enough for scheduling
+        return timezone(timedelta(hours=2))
+
+
+class PollSchedule:
+    """Decides how long to wait between polls.
+
+    The base interval is short during the gazette's publishing hours and long
+    outside them; every consecutive poll that finds nothing new stretches it by
+    IDLE_BACKOFF, up to `max_interval`, and a poll that finds something resets it."""
+
+    def __init__(self, interval=DEFAULT_INTERVAL, busy_interval=DEFAULT_BUSY_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL):
+        self.interval = interval
+        self.busy_interval = busy_interval
+        self.max_interval = max_interval
+        self.idle_polls = 0
+        self.tz = _israel_tz()
+
+    def is_publishing_time(self, now=None):
+        now = now or datetime.now(self.tz)
+        return now.weekday() in PUBLISHING_DAYS and now.hour in PUBLISHING_HOURS
+
+    def next_interval(self, found_new, now=None):
+        """Seconds to wait after a poll that found `found_new` new items."""
+        self.idle_polls = 0 if found_new else self.idle_polls + 1
+        base = self.busy_interval if self.is_publishing_time(now) else self.interval
+        return min(self.max_interval, base * IDLE_BACKOFF ** self.idle_polls)
+
+
+def run_forever(poll, schedule):
+    """Call `poll()`, which returns the number of new items, then sleep as `schedule`
+    says, until SIGINT or SIGTERM. A failing poll is logged and counts as finding nothing."""
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        logger.info(f'received signal {signum}, stopping after the current poll')
+        stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    while not stop.is_set():
+        try:
+            found_new = poll()
+        except (Exception, SystemExit):  # scraper raises SystemExit on API errors
+            logger.exception('poll failed')
+            found_new = 0
+        wait = schedule.next_interval(found_new)
+        logger.info(f'{found_new} new item(s); next poll in {wait / 60:.1f} min')
+        stop.wait(wait)